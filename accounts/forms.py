@@ -4,8 +4,10 @@ from django.contrib.auth.forms import (
     UserCreationForm as BaseUserCreationForm,
     UserChangeForm as BaseUserChangeForm,
 )
+from django.core.files.uploadedfile import UploadedFile
 
 from .models import User, Profile
+from .pictures import normalize_picture
 
 
 class UserCreationForm(BaseUserCreationForm):
@@ -33,3 +35,10 @@ class ProfileForm(forms.ModelForm):
             "biography",
             "picture",
         )
+
+    def clean_picture(self):
+        picture = self.cleaned_data.get("picture")
+        if isinstance(picture, UploadedFile):
+            # Keep newly uploaded pictures small and without metadata.
+            picture = normalize_picture(picture)
+        return picture
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Profile
+from accounts.pictures import executor, make_variants
+
+
+class Command(BaseCommand):
+    help = "Make variants of the profile pictures that don't have them."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Remake the variants of all profile pictures.",
+        )
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(picture="").exclude(picture=None)
+        if not options["all"]:
+            profiles = profiles.filter(picture_variants={})
+        profile_pks = list(profiles.values_list("pk", flat=True))
+
+        made = sum(executor.map(make_variants, profile_pks))
+        self.stdout.write(self.style.SUCCESS(
+            "Made variants of %s of %s pictures." % (made, len(profile_pks))
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 17:49
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_profile_picture'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(django.db.models.functions.text.Lower('identifier'), name='profile_lower_identifier_idx'),
+        ),
+    ]
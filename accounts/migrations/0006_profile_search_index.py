@@ -0,0 +1,76 @@
+# Generated by Django 4.0.6 on 2026-10-18 17:56
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def get_trigrams(text):
+    # A copy of accounts.search.get_trigrams as of this migration,
+    # so that changing that one doesn't change what this one does.
+    trigrams = set()
+    for word in re.findall(r"[^\W_]+", text.lower()):
+        word = "  %s " % word
+        trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return trigrams
+
+
+def index_profiles(apps, schema_editor):
+    Profile = apps.get_model("accounts", "Profile")
+    ProfileTrigram = apps.get_model("accounts", "ProfileTrigram")
+    profiles = list(Profile.objects.all())
+    for profile in profiles:
+        search_text = "%s %s" % (profile.first_name, profile.last_name)
+        search_text = "%s %s" % (search_text.strip(), profile.identifier or "")
+        profile.search_text = search_text.strip().lower()
+    Profile.objects.bulk_update(profiles, ["search_text"], batch_size=1000)
+
+    if schema_editor.connection.vendor == "postgresql":
+        # PostgreSQL indexes the search_text itself.
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            "CREATE INDEX profile_search_text_trgm_idx "
+            "ON accounts_profile USING gin (search_text gin_trgm_ops)"
+        )
+    else:
+        ProfileTrigram.objects.bulk_create([
+            ProfileTrigram(profile=profile, trigram=trigram)
+            for profile in profiles
+            for trigram in get_trigrams(profile.search_text)
+        ], batch_size=1000)
+
+
+def drop_postgres_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            "DROP INDEX IF EXISTS profile_search_text_trgm_idx"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_profile_picture_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='search_text',
+            field=models.CharField(blank=True, editable=False, max_length=92),
+        ),
+        migrations.CreateModel(
+            name='ProfileTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigrams', to='accounts.profile')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='profiletrigram',
+            index=models.Index(fields=['trigram', 'profile'], name='profile_trigram_idx'),
+        ),
+        migrations.RunPython(index_profiles, drop_postgres_index),
+    ]
@@ -5,6 +5,7 @@ from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.functions import Lower
 
 
 class UserManager(BaseUserManager):
@@ -76,6 +77,48 @@ class Profile(models.Model):
     biography = models.CharField("bio", max_length=200, blank=True)
     picture = models.ImageField("pic", upload_to="profile_pics",
                                 blank=True, null=True)
+    # Names of the resized copies of the picture by size and format,
+    # made in the background; see pictures.py.
+    picture_variants = models.JSONField(default=dict, blank=True,
+                                        editable=False)
+    # The names and ID in lowercase, which are indexed for search;
+    # see search.py.
+    search_text = models.CharField(max_length=92, blank=True,
+                                   editable=False)
+
+    class Meta:
+        indexes = [
+            # IDs are looked up case-insensitively.
+            models.Index(Lower("identifier"),
+                         name="profile_lower_identifier_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the loaded values to know which ones change on save.
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.search_text = self.get_search_text()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = update_fields = {*update_fields,
+                                                       "search_text"}
+        super().save(*args, **kwargs)
+        # The saved values are the ones to compare with on the next save.
+        self._loaded_values = {
+            **getattr(self, "_loaded_values", {}),
+            **{field.attname: getattr(self, field.attname)
+               for field in self._meta.concrete_fields
+               if update_fields is None or field.name in update_fields},
+        }
+
+    def get_search_text(self):
+        """Return the full name plus the ID, in lowercase."""
+        search_text = "%s %s" % (self.get_full_name(), self.identifier or "")
+        return search_text.strip().lower()
 
     def get_full_name(self):
         """Return the first_name plus the last_name,
@@ -100,3 +143,22 @@ class Profile(models.Model):
 
     def __str__(self) -> str:
         return "%s profile" % self.user.get_username()
+
+
+class ProfileTrigram(models.Model):
+    """A trigram of a profile's search_text; the search index
+    of databases that don't have one of their own.
+    """
+
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE,
+                                related_name="trigrams")
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["trigram", "profile"],
+                         name="profile_trigram_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return "%s: %s" % (self.profile_id, self.trigram)
@@ -0,0 +1,153 @@
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .models import Profile
+
+
+logger = logging.getLogger(__name__)
+
+# Originals are scaled down to fit in a square of this size on upload.
+MAX_PICTURE_SIZE = 1024
+# Sizes (of the smaller side) of the variants made from each picture.
+VARIANT_SIZES = (30, 64, 300)
+# Formats of the variants, by their names in Profile.picture_variants.
+VARIANT_FORMATS = {
+    "webp": ("WEBP", "webp", {"quality": 80}),
+    "jpeg": ("JPEG", "jpg", {"quality": 85, "optimize": True,
+                             "progressive": True}),
+}
+# Variants are named by a hash of their content, so their urls
+# never change meaning and can be cached forever.
+VARIANTS_DIR = "profile_pics/variants"
+
+ORIGINAL_FORMATS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+
+# Variants are made in the background by these workers,
+# so that no request has to wait for them.
+executor = ThreadPoolExecutor(max_workers=2,
+                              thread_name_prefix="pictures")
+
+
+def has_alpha(pic):
+    return pic.mode in ("RGBA", "LA", "PA") or "transparency" in pic.info
+
+
+def strip(pic):
+    """Return a copy of an image in the right orientation
+    and without any metadata (e.g. EXIF and its location).
+    """
+    pic = ImageOps.exif_transpose(pic)
+    pic = pic.convert("RGBA" if has_alpha(pic) else "RGB")
+    pic.info = {}
+    return pic
+
+
+def encode(pic, image_format, **params):
+    content = io.BytesIO()
+    pic.save(content, format=image_format, **params)
+    return content.getvalue()
+
+
+def normalize_picture(upload):
+    """Return an uploaded picture scaled down to MAX_PICTURE_SIZE,
+    with its metadata removed.
+    """
+    pic = Image.open(upload)
+    image_format = pic.format if pic.format in ORIGINAL_FORMATS else "PNG"
+    pic = strip(pic)
+    pic.thumbnail((MAX_PICTURE_SIZE, MAX_PICTURE_SIZE))
+    if image_format == "JPEG" and pic.mode != "RGB":
+        pic = pic.convert("RGB")
+
+    name = "%s.%s" % (PurePosixPath(upload.name).stem,
+                      ORIGINAL_FORMATS[image_format])
+    return SimpleUploadedFile(
+        name, encode(pic, image_format),
+        content_type=Image.MIME[image_format],
+    )
+
+
+def save_variant(storage, pic, variant_format):
+    """Save an image in one of the variant formats,
+    and return its name in the storage.
+    """
+    image_format, extension, params = VARIANT_FORMATS[variant_format]
+    if image_format == "JPEG" and pic.mode != "RGB":
+        background = Image.new("RGB", pic.size, "white")
+        background.paste(pic, mask=pic.getchannel("A"))
+        pic = background
+    content = encode(pic, image_format, **params)
+    name = "%s/%s.%s" % (VARIANTS_DIR,
+                         hashlib.sha256(content).hexdigest()[:16], extension)
+    # The same content is only stored once.
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(content))
+    return name
+
+
+def make_variants(profile_pk):
+    """Create and save the variants of a profile's picture.
+
+    Return whether variants were made.
+    """
+    close_old_connections()
+    try:
+        profile = Profile.objects.filter(pk=profile_pk).first()
+        if profile is None or not profile.picture:
+            return False
+        picture_name = profile.picture.name
+        storage = profile.picture.storage
+
+        with profile.picture.open("rb") as f:
+            pic = Image.open(f)
+            pic.load()
+        pic = strip(pic)
+        variants = {}
+        for size in VARIANT_SIZES:
+            # Its size should be so that the smaller side is `size`.
+            r = max(pic.size) / min(pic.size) * size
+            variant = pic.copy()
+            variant.thumbnail((r, r))
+            variants[str(size)] = {
+                variant_format: save_variant(storage, variant, variant_format)
+                for variant_format in VARIANT_FORMATS
+            }
+
+        # Only keep them if the picture hasn't changed in the meantime.
+        # The files are left either way; others may have the same content.
+        updated = Profile.objects.filter(
+            pk=profile_pk, picture=picture_name
+        ).update(picture_variants=variants)
+        return bool(updated)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(profile):
+    """Make the variants of a profile's picture in the background,
+    once the current transaction is committed.
+    """
+    def submit():
+        future = executor.submit(make_variants, profile.pk)
+        future.add_done_callback(
+            lambda future: log_variants_error(future, profile.pk)
+        )
+
+    transaction.on_commit(submit)
+
+
+def log_variants_error(future, profile_pk):
+    """Log the error that making the variants of a profile's picture
+    raised in the background, if any; nobody else sees it.
+    """
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Failed to make the picture variants of profile %s.",
+                     profile_pk, exc_info=future.exception())
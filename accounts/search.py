@@ -0,0 +1,98 @@
+import math
+import re
+
+from django.db import connection, transaction
+from django.db.models import Count, F
+
+from .models import Profile, ProfileTrigram
+
+
+# Most results a search can have; they're only useful at the top.
+MAX_RESULTS = 100
+# Part of the trigrams of a query that a profile should have in common
+# with it to match; the default threshold of PostgreSQL's pg_trgm.
+SIMILARITY = 0.6
+
+
+def get_trigrams(text):
+    """Return the set of trigrams of the words of a text,
+    in the same way as PostgreSQL's pg_trgm.
+    """
+    trigrams = set()
+    for word in re.findall(r"[^\W_]+", text.lower()):
+        word = "  %s " % word
+        trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return trigrams
+
+
+class TrigramTableBackend:
+    """Search with an index of the trigrams of the profiles in a table
+    (ProfileTrigram), which works with any database.
+
+    Backends index profiles, and make the queryset of the primary keys
+    of the profiles that match a query.
+    """
+
+    def index(self, profiles):
+        """Update the trigrams of the profiles."""
+        with transaction.atomic():
+            ProfileTrigram.objects.filter(profile__in=profiles).delete()
+            ProfileTrigram.objects.bulk_create([
+                ProfileTrigram(profile=profile, trigram=trigram)
+                for profile in profiles
+                for trigram in get_trigrams(profile.search_text)
+            ], batch_size=1000)
+
+    def get_queryset(self, query):
+        trigrams = get_trigrams(query)
+        if not trigrams:
+            return ProfileTrigram.objects.none()
+        needed = math.ceil(len(trigrams) * SIMILARITY)
+        return ProfileTrigram.objects.filter(
+            trigram__in=trigrams
+        ).values("profile").annotate(
+            hits=Count("pk")
+        ).filter(
+            hits__gte=needed
+        ).order_by("-hits", "profile").values_list(
+            "profile", flat=True
+        )[:MAX_RESULTS]
+
+
+class PostgresBackend:
+    """Search with pg_trgm and a trigram index of Profile.search_text."""
+
+    def index(self, profiles):
+        # The database keeps its index up to date itself.
+        pass
+
+    def get_queryset(self, query):
+        from django.contrib.postgres.lookups import TrigramWordSimilar
+        from django.contrib.postgres.search import TrigramWordSimilarity
+
+        query = query.lower()
+        return Profile.objects.filter(
+            TrigramWordSimilar(F("search_text"), query)
+        ).annotate(
+            rank=TrigramWordSimilarity(query, "search_text")
+        ).order_by("-rank", "pk").values_list(
+            "pk", flat=True
+        )[:MAX_RESULTS]
+
+
+def get_backend():
+    if connection.vendor == "postgresql":
+        return PostgresBackend()
+    return TrigramTableBackend()
+
+
+def index_profiles(profiles):
+    """Add the profiles, with their search_text set, to the index."""
+    get_backend().index(profiles)
+
+
+def search_profiles(query):
+    """Return primary keys of the profiles whose names or IDs
+    are similar to the query, the most similar ones first.
+    """
+    return list(get_backend().get_queryset(query))
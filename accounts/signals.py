@@ -3,6 +3,7 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 from .models import User, Profile
+from .search import index_profiles
 
 
 @receiver(post_save, sender=User)
@@ -11,3 +12,11 @@ def create_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
     else:
         instance.profile.save()
+
+
+@receiver(post_save, sender=Profile)
+def index_profile(sender, instance, created, **kwargs):
+    """Keep the search index up to date with the names and ID."""
+    loaded_values = getattr(instance, "_loaded_values", {})
+    if created or loaded_values.get("search_text") != instance.search_text:
+        index_profiles([instance])
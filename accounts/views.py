@@ -10,6 +10,7 @@ from django.views.generic import CreateView, UpdateView
 
 from .forms import UserCreationForm, ProfileForm
 from .models import Profile
+from .pictures import schedule_variants
 
 
 class SignupView(CreateView):
@@ -37,3 +38,13 @@ class ProfileView(LoginRequiredMixin, UpdateView):
 
     def get_object(self, queryset=None):
         return get_object_or_404(Profile, user=self.request.user)
+
+    def form_valid(self, form):
+        picture_changed = "picture" in form.changed_data
+        if picture_changed:
+            # The old variants don't belong to the new picture.
+            form.instance.picture_variants = {}
+        response = super().form_valid(form)
+        if picture_changed and form.instance.picture:
+            schedule_variants(form.instance)
+        return response
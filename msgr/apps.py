@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MsgrConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'msgr'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,167 @@
+import asyncio
+import json
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.db import close_old_connections
+from django.http import HttpRequest
+from django.http.cookie import parse_cookie
+from django.http.request import split_domain_port, validate_host
+
+from .hub import hub
+from .membership import is_member
+from .models import Chat, Message
+from .serializers import serialize_messages
+from .views import mark_seen
+
+
+def database_sync_to_async(func):
+    """Run a sync function that uses the database in a thread,
+    closing stale connections around it like a request would.
+    """
+    def inner(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(inner)
+
+
+class ChatConsumer:
+    """Push updates about a chat to a connected websocket client.
+
+    This is a plain ASGI application; it sends new messages, seen
+    receipts and deletions of the chat as they're published to the hub.
+    """
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.chat_id = scope["url_route"]["kwargs"]["pk"]
+        self.user = None
+        self.latest_seen_pk = 0
+
+    @classmethod
+    def as_asgi(cls):
+        """Return an ASGI application that handles each connection
+        with a new instance of the class.
+        """
+        async def app(scope, receive, send):
+            await cls(scope, receive, send).handle()
+        return app
+
+    def get_header(self, name):
+        for key, value in self.scope.get("headers", []):
+            if key.decode("latin1").lower() == name:
+                return value.decode("latin1")
+        return None
+
+    def origin_allowed(self):
+        """Reject cross-site connections, since they're authorized
+        by the session cookie.
+        """
+        origin = self.get_header("origin")
+        if origin is None:
+            return True
+        domain, port = split_domain_port(urlsplit(origin).netloc)
+        allowed_hosts = settings.ALLOWED_HOSTS
+        if settings.DEBUG and not allowed_hosts:
+            allowed_hosts = [".localhost", "127.0.0.1", "[::1]"]
+        return bool(domain) and validate_host(domain, allowed_hosts)
+
+    def get_user(self):
+        """Return the user of the session in the connection's cookies."""
+        cookies = parse_cookie(self.get_header("cookie") or "")
+        engine = import_module(settings.SESSION_ENGINE)
+        request = HttpRequest()
+        request.session = engine.SessionStore(
+            cookies.get(settings.SESSION_COOKIE_NAME)
+        )
+        return auth.get_user(request)
+
+    def authorize(self):
+        self.user = self.get_user()
+        if not self.user.is_authenticated:
+            return False
+        if not is_member(self.user.pk, self.chat_id):
+            return False
+        # The latest message of the user that the client knows is seen.
+        self.latest_seen_pk = Chat(pk=self.chat_id).get_read_pk(self.user)
+        return True
+
+    async def handle(self):
+        message = await self.receive()
+        if message["type"] != "websocket.connect":
+            return
+        if not (self.origin_allowed()
+                and await database_sync_to_async(self.authorize)()):
+            await self.send({"type": "websocket.close", "code": 4403})
+            return
+
+        queue = hub.subscribe(self.chat_id)
+        await self.send({"type": "websocket.accept"})
+        disconnect = asyncio.ensure_future(self.wait_for_disconnect())
+        try:
+            while True:
+                event = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait(
+                    {event, disconnect},
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnect in done:
+                    event.cancel()
+                    break
+                data = await database_sync_to_async(self.get_data)(
+                    event.result()
+                )
+                if data:
+                    await self.send({"type": "websocket.send",
+                                     "text": json.dumps(data)})
+        finally:
+            hub.unsubscribe(self.chat_id, queue)
+            disconnect.cancel()
+
+    async def wait_for_disconnect(self):
+        # Clients don't send anything; just wait for them to leave.
+        while True:
+            message = await self.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+    def get_data(self, event):
+        """Convert an event of the hub to the json data
+        that is sent to the client.
+        """
+        if event["type"] == "messages":
+            # The latest message first, like in pages of messages.
+            messages = sorted(event["messages"], key=lambda m: m.pk,
+                              reverse=True)
+            received = [m for m in messages if m.sender_id != self.user.pk]
+            if received:
+                # Delivering messages means they're seen:
+                mark_seen(Chat(pk=self.chat_id), self.user, received[0].pk)
+            return {
+                "type": "messages",
+                **serialize_messages(messages, self.latest_seen_pk),
+                "latest_pk": messages[0].pk,
+            }
+        elif event["type"] == "seen":
+            if (event["user"] == self.user.pk
+                    or event["pk"] <= self.latest_seen_pk):
+                return None
+            seen_messages_pk = list(Message.objects.filter(
+                chat=self.chat_id,
+                pk__gt=self.latest_seen_pk,
+                pk__lte=event["pk"],
+                sender=self.user,
+            ).order_by("pk").values_list("pk", flat=True))
+            self.latest_seen_pk = event["pk"]
+            return {"type": "seen", "seen_messages_pk": seen_messages_pk}
+        elif event["type"] == "delete":
+            return {"type": "delete", "pk": event["pk"]}
+        return None
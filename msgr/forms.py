@@ -8,6 +8,12 @@ class SearchForm(forms.Form):
     q = forms.CharField(strip=True, min_length=4)
 
 
+class MessageSearchForm(forms.Form):
+    q = forms.CharField(strip=True, min_length=2)
+    # To only search in one of the user's chats.
+    chat = forms.IntegerField(required=False, widget=forms.HiddenInput)
+
+
 class MessageForm(forms.ModelForm):
 
     class Meta:
@@ -0,0 +1,84 @@
+import uuid
+
+from django.core.cache import caches
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from .mentions import resolve_mentions
+from accounts.models import Profile
+
+
+# Cache alias of the rendered messages. Any backend works; the default
+# settings use local memory, which evicts the least recently used ones.
+# Local memory isn't shared, so a version bumped in one process doesn't
+# reach the others, whose messages are only re-rendered as they expire;
+# with several processes, use a shared backend (e.g. memcached or redis).
+CACHE_ALIAS = "messages"
+VERSION_KEY = "message-fragments-version"
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def get_version():
+    """Return the current version of the rendered messages.
+
+    It changes whenever the way users appear in messages (their names
+    and IDs) changes, which makes all the cached messages stale.
+    """
+    # It never expires, since a new one would make them all stale too.
+    return get_cache().get_or_set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def bump_version():
+    get_cache().set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def get_key(message_pk, side, version):
+    return "message:%s:%s:%s" % (message_pk, side, version)
+
+
+def render_messages(message_list, user):
+    """Set the rendered html of each message of the list as its 'fragment',
+    from the cache or by rendering the ones that aren't cached.
+
+    The fragment only covers what never changes about a message: the
+    sender's link, the content and the date, each a complete element.
+    The enclosing element, the time and the seen status are left out.
+    """
+    cache = get_cache()
+    version = get_version()
+    keys = {}
+    for m in message_list:
+        side = "right" if m.sender_id == user.pk else "left"
+        keys[m.pk] = get_key(m.pk, side, version)
+    fragments = cache.get_many(keys.values())
+
+    missing = [m for m in message_list if keys[m.pk] not in fragments]
+    if missing:
+        resolve_mentions([m.content for m in missing])
+        profiles = Profile.objects.filter(
+            user__in={m.sender_id for m in missing}
+        )
+        profiles = {profile.user_id: profile for profile in profiles}
+        template = get_template("msgr/message.html")
+        rendered = {}
+        for m in missing:
+            rendered[keys[m.pk]] = template.render({
+                "m": m,
+                "user": user,
+                "profile": profiles.get(m.sender_id),
+            })
+        cache.set_many(rendered)
+        fragments.update(rendered)
+
+    for m in message_list:
+        m.fragment = mark_safe(fragments[keys[m.pk]])
+
+
+def forget_message(message_pk):
+    """Remove the rendered html of a message from the cache."""
+    version = get_version()
+    get_cache().delete_many([get_key(message_pk, side, version)
+                             for side in ("left", "right")])
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class ChatHub:
+    """In-process fan-out of chat events to their subscribers.
+
+    Subscribers are asyncio queues keyed by chat id; each one belongs to
+    the event loop it was created in. Events can be published from any
+    thread (e.g. from sync views), and are handed over to the loops
+    thread-safely.
+
+    The hub only lives in the current process, so every worker process
+    only notifies the clients connected to it.
+    """
+
+    # Maximum number of pending events for a single subscriber.
+    # Events for a subscriber that isn't keeping up are dropped.
+    QUEUE_SIZE = 100
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, chat_id):
+        """Return a new queue that receives events of the chat.
+
+        Must be called from inside a running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[chat_id].add((loop, queue))
+        return queue
+
+    def unsubscribe(self, chat_id, queue):
+        """Stop sending events of the chat to the queue."""
+        with self._lock:
+            subscribers = self._subscribers.get(chat_id, set())
+            for subscriber in [s for s in subscribers if s[1] is queue]:
+                subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(chat_id, None)
+
+    def has_subscribers(self, chat_id):
+        return bool(self._subscribers.get(chat_id))
+
+    def publish(self, chat_id, event):
+        """Send an event to every subscriber of the chat."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(chat_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, event)
+            except RuntimeError:
+                # The subscriber's loop is already closed.
+                self.unsubscribe(chat_id, queue)
+
+    @staticmethod
+    def _put(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+
+hub = ChatHub()
@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from msgr.models import ArchivedMessage, Message
+
+
+class Command(BaseCommand):
+    help = ("Move messages older than a number of days to the archive, "
+            "where chats still show them but search doesn't find them. "
+            "It's done in batches, so it can be stopped and run again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=365,
+            help="Age in days of the messages to archive.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Number of messages moved at a time.",
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] < 0 or options["batch_size"] < 1:
+            raise CommandError("--days and --batch-size must be positive.")
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        old_messages = Message.objects.filter(
+            send_time__lt=cutoff
+        ).order_by("pk")
+
+        archived = last_pk = 0
+        while True:
+            batch = list(old_messages.filter(pk__gt=last_pk)
+                         [:options["batch_size"]])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            archived += self.archive(batch, cutoff)
+            self.stdout.write("Archived %s messages..." % archived)
+        self.stdout.write(self.style.SUCCESS(
+            "Archived %s messages sent before %s." % (archived, cutoff)
+        ))
+
+    def archive(self, batch, cutoff):
+        """Move the messages of a batch to the archive; return how many."""
+        # Chats page through the archive once their messages run out,
+        # so a message is only archived if all older ones are too;
+        # i.e. if it's older than the oldest recent one of the chat.
+        recent_pks = dict(Message.objects.filter(
+            chat__in={m.chat_id for m in batch}, send_time__gte=cutoff,
+        ).order_by().values("chat").annotate(
+            min_pk=Min("pk")
+        ).values_list("chat", "min_pk"))
+        batch = [m for m in batch
+                 if m.pk < recent_pks.get(m.chat_id, m.pk + 1)]
+        with transaction.atomic():
+            # Conflicts are messages archived by an interrupted run.
+            ArchivedMessage.objects.bulk_create([
+                ArchivedMessage(pk=m.pk, chat_id=m.chat_id,
+                                sender_id=m.sender_id, content=m.content,
+                                send_time=m.send_time)
+                for m in batch
+            ], ignore_conflicts=True)
+            # Deleting them also removes them from the search index.
+            Message.objects.filter(pk__in=[m.pk for m in batch]).delete()
+        return len(batch)
@@ -0,0 +1,294 @@
+import json
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import resolve, reverse
+
+from accounts.models import User
+from msgr.models import Join, Message
+from msgr.seeding import seed_database
+
+
+class SimulatedUser(threading.Thread):
+    """A user going through chats like the web client does, and
+    recording the time and queries of each request.
+
+    In each visit, the user opens the chats list and one of the chats,
+    and loads its latest messages (and sometimes older ones); then polls
+    for updates a few times, sending messages now and then.
+    """
+
+    def __init__(self, user, chat_pks, seed, options):
+        super().__init__(daemon=True)
+        # Errors are recorded as responses, instead of stopping the user.
+        self.client = Client(raise_request_exception=False)
+        self.client.force_login(user)
+        self.chat_pks = chat_pks
+        self.rng = random.Random(seed)
+        self.deadline = None
+        self.options = options
+        # (url name, milliseconds, queries, status code) of each request.
+        self.requests = []
+
+    def start(self, deadline):
+        """Start going through chats until the deadline."""
+        self.deadline = deadline
+        super().start()
+
+    def run(self):
+        try:
+            while time.monotonic() < self.deadline:
+                self.visit(self.rng.choice(self.chat_pks))
+        finally:
+            connections.close_all()
+
+    def visit(self, chat_pk):
+        self.request("get", reverse("msgr:main"))
+        self.think()
+        chat_path = reverse("msgr:chat", args=[chat_pk])
+        self.request("get", chat_path)
+        messages_path = reverse("msgr:messages_data", args=[chat_pk])
+        response = self.request("get", messages_path)
+        if response.status_code != 200:
+            return
+        data = response.json()
+        if data["has_more"] and self.rng.random() < 0.3:
+            self.think()
+            self.request("get", messages_path,
+                         {"before_pk": data["last_item_pk"]})
+
+        updates_path = reverse("msgr:updates_data", args=[chat_pk])
+        latest_pk = data["first_item_pk"]
+        latest_seen_pk = 0
+        for _ in range(self.options["polls"]):
+            if time.monotonic() >= self.deadline:
+                break
+            if self.rng.random() < self.options["send_rate"]:
+                self.think()
+                self.request("post", chat_path, {
+                    "content": "load test %s" % self.rng.randrange(10 ** 6),
+                })
+            response = self.request("get", updates_path, {
+                "latest_pk": latest_pk,
+                "latest_seen_pk": latest_seen_pk,
+                "wait": self.options["poll_wait"],
+            })
+            if response.status_code != 200:
+                return
+            data = response.json()
+            latest_pk = data["latest_pk"]
+            latest_seen_pk = data["latest_seen_pk"]
+        # Leaving the chat page records the user's activity.
+        self.request("post", chat_path)
+
+    def request(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(self.client, method)(path, data)
+            elapsed = time.perf_counter() - start
+        self.requests.append((resolve(path).url_name, elapsed * 1000,
+                              len(queries), response.status_code))
+        return response
+
+    def think(self):
+        """Pause like a user does between actions."""
+        time.sleep(self.rng.uniform(0, 2 * self.options["think"]))
+
+
+class Command(BaseCommand):
+    help = ("Seed a test database, run simulated users through the chats "
+            "concurrently for a while, and report the throughput, latency "
+            "and queries of each url.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clients", type=int, default=20,
+            help="Number of simulated users.",
+        )
+        parser.add_argument(
+            "--duration", type=float, default=60,
+            help="Seconds to run the simulated users for.",
+        )
+        parser.add_argument(
+            "--poll-wait", type=float, default=10,
+            help="Seconds each poll for updates waits for them "
+                 "(the web client waits up to 25).",
+        )
+        parser.add_argument(
+            "--polls", type=int, default=5,
+            help="Number of polls for updates in each visit of a chat.",
+        )
+        parser.add_argument(
+            "--send-rate", type=float, default=0.3,
+            help="Chance of sending a message before each poll.",
+        )
+        parser.add_argument(
+            "--think", type=float, default=0.5,
+            help="Average seconds users pause between actions.",
+        )
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--chats-per-user", type=int, default=5)
+        parser.add_argument("--messages", type=int, default=20000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--output",
+            help="Save the results as json to this file.",
+        )
+        parser.add_argument(
+            "--compare",
+            help="Compare the results with the ones saved in this file.",
+        )
+        parser.add_argument(
+            "--keepdb", action="store_true",
+            help="Keep the test database (and its data) between runs.",
+        )
+
+    def handle(self, *args, **options):
+        if options["clients"] > options["users"]:
+            raise CommandError("--clients can't be more than --users.")
+        previous = None
+        if options["compare"]:
+            try:
+                with open(options["compare"]) as f:
+                    previous = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(e)
+
+        old_name = connection.settings_dict["NAME"]
+        if (connection.vendor == "sqlite"
+                and not connection.settings_dict["TEST"]["NAME"]):
+            # Concurrent writes to an in-memory database fail
+            # instead of waiting for each other.
+            connection.settings_dict["TEST"]["NAME"] = "test_load.sqlite3"
+        # The test client's requests are for the 'testserver' host,
+        # which the test environment allows.
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0,
+                                           keepdb=options["keepdb"])
+        try:
+            if not Message.objects.exists():
+                self.stdout.write("Seeding the database...")
+                seed_database(options["users"], options["chats_per_user"],
+                              options["messages"], options["seed"])
+            requests, elapsed = self.run_clients(options)
+        finally:
+            if not options["keepdb"]:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        results = self.get_results(requests, elapsed)
+        self.report(results, previous)
+        errors = sum(url["errors"] for url in results["urls"].values())
+        if not requests or errors > len(requests) / 2:
+            raise CommandError(
+                "%s of %s requests failed; the results aren't saved."
+                % (errors, len(requests))
+            )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump({
+                    "vendor": connection.vendor,
+                    "options": {k: options[k] for k in (
+                        "clients", "duration", "poll_wait", "polls",
+                        "send_rate", "think", "users", "chats_per_user",
+                        "messages", "seed",
+                    )},
+                    **results,
+                }, f, indent=2)
+
+    def run_clients(self, options):
+        """Run the simulated users; return their requests
+        and how long it took.
+        """
+        users = User.objects.order_by("pk")[:options["clients"]]
+        chat_pks = defaultdict(list)
+        for user_id, chat_id in Join.objects.filter(
+            user__in=users
+        ).values_list("user", "chat").order_by("chat"):
+            chat_pks[user_id].append(chat_id)
+        clients = [
+            SimulatedUser(user, chat_pks[user.pk], options["seed"] + i,
+                          options)
+            for i, user in enumerate(users) if chat_pks[user.pk]
+        ]
+        # Everyone starts at once, with the connections of this thread
+        # closed so that it doesn't hold the database.
+        connections.close_all()
+        start = time.monotonic()
+        deadline = start + options["duration"]
+        self.stdout.write("Running %s simulated users for %s seconds..." % (
+            len(clients), options["duration"]
+        ))
+        for client in clients:
+            client.start(deadline)
+        for client in clients:
+            client.join()
+        elapsed = time.monotonic() - start
+        return [r for client in clients for r in client.requests], elapsed
+
+    @staticmethod
+    def get_results(requests, elapsed):
+        """Return the throughput, and latency percentiles and
+        queries per request of each url name.
+        """
+        by_url_name = defaultdict(list)
+        for request in requests:
+            by_url_name[request[0]].append(request)
+        urls = {}
+        for url_name, url_requests in sorted(by_url_name.items()):
+            timings = sorted(r[1] for r in url_requests)
+            if len(timings) > 1:
+                percentiles = statistics.quantiles(timings, n=100,
+                                                   method="inclusive")
+            else:
+                percentiles = timings * 99
+            urls[url_name] = {
+                "requests": len(url_requests),
+                "errors": sum(1 for r in url_requests if r[3] >= 400),
+                "p50_ms": percentiles[49],
+                "p95_ms": percentiles[94],
+                "p99_ms": percentiles[98],
+                "queries": statistics.mean(r[2] for r in url_requests),
+            }
+        return {
+            "elapsed": elapsed,
+            "requests": len(requests),
+            "throughput": len(requests) / elapsed,
+            "urls": urls,
+        }
+
+    def report(self, results, previous=None):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            "%s requests in %.1f s: %.1f requests/s" % (
+                results["requests"], results["elapsed"],
+                results["throughput"],
+            )
+        ))
+        if previous:
+            self.stdout.write("(was %.1f requests/s)" % previous["throughput"])
+        self.stdout.write("%-16s %8s %6s %9s %9s %9s %8s" % (
+            "url", "requests", "errors", "p50 ms", "p95 ms", "p99 ms",
+            "queries",
+        ))
+        for url_name, url in results["urls"].items():
+            self.stdout.write("%-16s %8s %6s %9.1f %9.1f %9.1f %8.1f" % (
+                url_name, url["requests"], url["errors"], url["p50_ms"],
+                url["p95_ms"], url["p99_ms"], url["queries"],
+            ))
+            old = previous and previous["urls"].get(url_name)
+            if old:
+                self.stdout.write("%-16s %8s %6s %9.1f %9.1f %9.1f %8.1f" % (
+                    "  (was)", old["requests"], old["errors"], old["p50_ms"],
+                    old["p95_ms"], old["p99_ms"], old["queries"],
+                ))
@@ -0,0 +1,121 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count, Max
+from django.test import RequestFactory
+
+from accounts.models import User
+from accounts.search import get_backend
+from msgr.models import Chat, Join, Message
+from msgr.search import search_messages
+from msgr.seeding import seed_database
+from msgr.views import ChatsListView, ChatMessagesView
+
+
+class Command(BaseCommand):
+    help = ("Seed a test database with a large dataset, and record "
+            "the query plans and timings of the views' queries.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--chats-per-user", type=int, default=5)
+        parser.add_argument("--messages", type=int, default=200000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--repeat", type=int, default=20,
+            help="Number of times each query is run for timing.",
+        )
+        parser.add_argument(
+            "--output",
+            help="Save the results as json to this file.",
+        )
+        parser.add_argument(
+            "--keepdb", action="store_true",
+            help="Keep the test database (and its data) between runs.",
+        )
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0,
+                                           keepdb=options["keepdb"])
+        try:
+            if not Message.objects.exists():
+                self.stdout.write("Seeding the database...")
+                seed_database(options["users"], options["chats_per_user"],
+                              options["messages"], options["seed"])
+            results = self.benchmark(options["repeat"])
+        finally:
+            if not options["keepdb"]:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for result in results:
+            self.stdout.write(self.style.MIGRATE_HEADING(result["name"]))
+            self.stdout.write(result["sql"])
+            self.stdout.write(result["plan"])
+            self.stdout.write("median %.3f ms, min %.3f ms\n" % (
+                result["median_ms"], result["min_ms"]
+            ))
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump({
+                    "vendor": connection.vendor,
+                    "options": {k: options[k] for k in (
+                        "users", "chats_per_user", "messages", "seed"
+                    )},
+                    "results": results,
+                }, f, indent=2)
+
+    def get_queries(self):
+        """Return names and querysets of the hot queries of the views."""
+        user = User.objects.annotate(
+            Count("joins")
+        ).order_by("-joins__count").first()
+        chat = Chat.objects.filter(participants=user).annotate(
+            Count("messages")
+        ).order_by("-messages__count").first()
+        messages = chat.messages.all()
+        middle_pk = messages.order_by("pk")[messages.count() // 2].pk
+        request = RequestFactory().get("/", {"q": "user1"})
+        request.user = user
+
+        chats_list = ChatsListView(request=request)
+        history = ChatMessagesView(request=request, object=chat)
+        search_query = get_backend().get_queryset("user1")
+        return [
+            ("chats list", chats_list.get_queryset()[:30]),
+            ("history first page", history.get_queryset()[:21]),
+            ("history middle page",
+             history.get_queryset().filter(pk__lt=middle_pk)[:21]),
+            ("new messages",
+             messages.filter(pk__gt=middle_pk).order_by("pk")),
+            ("read watermark",
+             Join.objects.filter(chat=chat).exclude(user=user).values(
+                 "chat"
+             ).annotate(
+                 read_pk=Max("last_read_message_id")
+             ).values("read_pk").order_by()),
+            ("seen messages",
+             messages.filter(pk__gt=middle_pk, sender=user).order_by("pk")),
+            ("search", search_query),
+            ("message search", search_messages("message 1", user)),
+        ]
+
+    def benchmark(self, repeat):
+        results = []
+        for name, queryset in self.get_queries():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            results.append({
+                "name": name,
+                "sql": str(queryset.query),
+                "plan": queryset.explain(),
+                "median_ms": statistics.median(timings),
+                "min_ms": min(timings),
+            })
+        return results
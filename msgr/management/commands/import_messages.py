@@ -0,0 +1,109 @@
+import json
+import sys
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from msgr import writebehind
+from msgr.forms import MessageForm
+from msgr.models import Join, Message, lat_updates
+from msgr.search import index_messages
+
+
+class Command(BaseCommand):
+    help = ("Import messages from a JSONL file (or - for stdin), with "
+            "one message per line like {\"chat\": 1, \"sender\": 1, "
+            "\"content\": \"...\", \"send_time\": \"2022-01-01T00:00Z\"}. "
+            "Imported messages don't count as unread; run unread_counts "
+            "afterwards to count the ones sent since users were active.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument(
+            "--chunk-size", type=int, default=1000,
+            help="Number of messages read and saved at a time.",
+        )
+
+    def handle(self, *args, **options):
+        if options["path"] == "-":
+            lines = enumerate(sys.stdin, 1)
+            self.import_lines(lines, options["chunk_size"])
+        else:
+            try:
+                with open(options["path"], encoding="utf-8") as f:
+                    self.import_lines(enumerate(f, 1), options["chunk_size"])
+            except OSError as e:
+                raise CommandError(e)
+
+    def import_lines(self, lines, chunk_size):
+        imported = skipped = 0
+        while True:
+            # Only one chunk of the file is in memory at a time.
+            chunk = list(islice(lines, chunk_size))
+            if not chunk:
+                break
+            messages = self.get_messages(chunk)
+            skipped += sum(1 for _, line in chunk if line.strip())
+            skipped -= len(messages)
+            with transaction.atomic():
+                messages = Message.objects.bulk_create(messages)
+                # Bulk creation skips the signal that indexes them.
+                index_messages(messages)
+            for message in messages:
+                lat_updates.add(message.chat_id, message.send_time)
+            imported += len(messages)
+            self.stdout.write("Imported %s messages..." % imported)
+        writebehind.flush_all()
+        self.stdout.write(self.style.SUCCESS(
+            "Imported %s messages, skipped %s." % (imported, skipped)
+        ))
+
+    def get_messages(self, chunk):
+        """Return the valid messages of a chunk of numbered lines."""
+        items = []
+        for number, line in chunk:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                chat_id, sender_id = int(item["chat"]), int(item["sender"])
+                send_time = item.get("send_time")
+                if send_time is not None:
+                    send_time = parse_datetime(send_time)
+                    if send_time is None:
+                        raise ValueError("invalid send_time")
+                    if timezone.is_naive(send_time):
+                        send_time = timezone.make_aware(send_time)
+            except (ValueError, KeyError, TypeError) as e:
+                self.stderr.write("Line %s: %s" % (number, e))
+                continue
+            form = MessageForm({"content": item.get("content")})
+            if not form.is_valid():
+                self.stderr.write("Line %s: %s" % (
+                    number, form.errors.as_text().replace("\n", " ")
+                ))
+                continue
+            message = form.save(commit=False)
+            message.chat_id = chat_id
+            message.sender_id = sender_id
+            if send_time is not None:
+                message.send_time = send_time
+            items.append((number, message))
+
+        # Senders should be in the chats of their messages.
+        joins = set(Join.objects.filter(
+            chat__in={m.chat_id for _, m in items},
+            user__in={m.sender_id for _, m in items},
+        ).values_list("chat", "user"))
+        messages = []
+        for number, message in items:
+            if (message.chat_id, message.sender_id) in joins:
+                messages.append(message)
+            else:
+                self.stderr.write("Line %s: sender %s isn't in chat %s" % (
+                    number, message.sender_id, message.chat_id
+                ))
+        return messages
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts.models import User
+from msgr.seeding import PASSWORD, seed_database
+
+
+class Command(BaseCommand):
+    help = ("Fill an empty database with a synthetic dataset for scale "
+            "testing; the same one for the same options. At scale 1 it "
+            "has 10,000 users and a million messages.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale", type=float, default=1,
+            help="Multiplies the numbers of users, chats and messages.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--chats-per-user", type=int, default=5,
+            help="Number of private chats each user starts.",
+        )
+        parser.add_argument(
+            "--max-group-size", type=int, default=50,
+            help="Most members a group chat can have.",
+        )
+        parser.add_argument(
+            "--mention-rate", type=float, default=0.05,
+            help="Share of messages that mention someone.",
+        )
+        parser.add_argument(
+            "--days", type=int, default=365,
+            help="Number of days the messages are spread over.",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options["scale"] <= 0:
+            raise CommandError("--scale must be positive.")
+        if User.objects.exists():
+            raise CommandError("The database already has users; "
+                               "seed an empty one.")
+        scale = options["scale"]
+        users = max(3, round(10000 * scale))
+        start = time.monotonic()
+        with transaction.atomic():
+            seed_database(
+                users, min(options["chats_per_user"], users),
+                round(1000000 * scale), options["seed"],
+                groups=round(500 * scale),
+                max_group_size=options["max_group_size"],
+                mention_rate=options["mention_rate"],
+                days=options["days"], batch_size=options["batch_size"],
+                log=self.stdout.write,
+            )
+        self.stdout.write(self.style.SUCCESS(
+            "Seeded the database in %.0f seconds. Users log in as "
+            "user<n>@example.com with the password %r."
+            % (time.monotonic() - start, PASSWORD)
+        ))
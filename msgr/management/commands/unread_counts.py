@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from msgr.models import Join, Message
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the unread messages counters of all chat joins "
+            "from the messages, or only verify them with --check.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report the counters that are wrong.",
+        )
+
+    def handle(self, *args, **options):
+        # Unread messages of a join are the ones sent by others since the
+        # last time its user was in the chat, and aren't read yet.
+        unread_messages = Message.objects.filter(
+            chat=OuterRef("chat"),
+            send_time__gt=OuterRef("last_active"),
+            pk__gt=OuterRef("last_read_message_id"),
+        ).exclude(
+            sender=OuterRef("user")
+        ).order_by().values("chat").annotate(count=Count("pk"))
+        actual_count = Coalesce(Subquery(unread_messages.values("count")), 0)
+
+        if options["check"]:
+            wrong_joins = Join.objects.annotate(
+                actual_count=actual_count
+            ).exclude(unread_count=F("actual_count"))
+            for join in wrong_joins:
+                self.stdout.write("join (%s): %s instead of %s" % (
+                    join.pk, join.unread_count, join.actual_count
+                ))
+            if wrong_joins:
+                raise CommandError("%s counters are wrong." % len(wrong_joins))
+            self.stdout.write(self.style.SUCCESS("All counters are correct."))
+        else:
+            updated = Join.objects.update(unread_count=actual_count)
+            self.stdout.write(self.style.SUCCESS(
+                "Rebuilt %s counters." % updated
+            ))
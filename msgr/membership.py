@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.cache import caches
+
+from .caches import TTLCache
+from .models import Join
+
+
+# Seconds a membership is cached for. Memberships are forgotten when
+# they change, but only in the process (and the shared cache) where
+# they change, so other processes may use stale ones for this long.
+TTL = 60
+# If a cache with this alias is in the settings (e.g. memcached or
+# redis), processes share the memberships through it.
+SHARED_CACHE_ALIAS = "membership"
+
+# Whether users are in chats, by (user_id, chat_id).
+memberships = TTLCache(maxsize=10000, ttl=TTL)
+
+
+def get_shared_cache():
+    if SHARED_CACHE_ALIAS in settings.CACHES:
+        return caches[SHARED_CACHE_ALIAS]
+    return None
+
+
+def get_key(user_id, chat_id):
+    return "membership:%s:%s" % (user_id, chat_id)
+
+
+def is_member(user_id, chat_id):
+    """Return whether a user is in a chat; from the cache if possible."""
+    if user_id is None:
+        return False
+    user_id, chat_id = int(user_id), int(chat_id)
+    member = memberships.get((user_id, chat_id))
+    if member is not None:
+        return member
+
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        member = shared_cache.get(get_key(user_id, chat_id))
+    if member is None:
+        member = Join.objects.filter(user=user_id, chat=chat_id).exists()
+        if shared_cache is not None:
+            shared_cache.set(get_key(user_id, chat_id), member, TTL)
+    memberships.set((user_id, chat_id), member)
+    return member
+
+
+def forget_membership(user_id, chat_id):
+    """Remove a membership from the cache; e.g. when it's changed."""
+    memberships.discard((user_id, chat_id))
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        shared_cache.delete(get_key(user_id, chat_id))
@@ -0,0 +1,72 @@
+import re
+from collections import defaultdict
+
+from django.db.models.functions import Lower
+
+from .caches import TTLCache
+from accounts.models import Profile
+
+
+# Words starting with an '@' character, which mention users by their IDs.
+MENTION_RE = re.compile(r"@(\w{5,})")
+
+_MISSING = object()
+
+
+# Seconds a mention is cached for. Mentions are forgotten when profiles
+# change, but only in the process where they change, so other processes
+# may link to the wrong profiles (e.g. after an ID is taken) for this long.
+TTL = 60
+
+# Primary keys of profiles by their lowercase IDs,
+# or None for IDs that don't belong to anyone.
+profile_pks = TTLCache(maxsize=10000, ttl=TTL)
+
+
+def resolve_mentions(texts):
+    """Find the profiles mentioned in all of the texts.
+
+    Return a dictionary of the mentioned IDs (lowercase) to primary keys
+    of their profiles, or None if they don't exist. IDs that aren't
+    cached already are looked up with a single query.
+    """
+    identifiers = {
+        identifier.lower()
+        for text in texts
+        for identifier in MENTION_RE.findall(text)
+    }
+    resolved = {}
+    missing = []
+    for identifier in identifiers:
+        pk = profile_pks.get(identifier, _MISSING)
+        if pk is _MISSING:
+            missing.append(identifier)
+        else:
+            resolved[identifier] = pk
+
+    if missing:
+        found = defaultdict(list)
+        profiles = Profile.objects.annotate(
+            lower_identifier=Lower("identifier")
+        ).filter(lower_identifier__in=missing)
+        for pk, identifier in profiles.values_list("pk", "lower_identifier"):
+            found[identifier].append(pk)
+        for identifier in missing:
+            pks = found[identifier]
+            # Only link to a user if there's exactly one with the ID.
+            resolved[identifier] = pks[0] if len(pks) == 1 else None
+            profile_pks.set(identifier, resolved[identifier])
+    return resolved
+
+
+def forget_profile(profile, created=False):
+    """Remove a profile's ID, and the one it was loaded with,
+    from the cache; e.g. when it's changed.
+    """
+    loaded_values = getattr(profile, "_loaded_values", {})
+    if not created and "identifier" not in loaded_values:
+        # Its previous ID isn't known, so the whole cache is searched.
+        profile_pks.discard_value(profile.pk)
+    for identifier in {loaded_values.get("identifier"), profile.identifier}:
+        if identifier:
+            profile_pks.discard(identifier.lower())
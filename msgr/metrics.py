@@ -0,0 +1,151 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# Upper bounds in seconds of the buckets of the latency histograms.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Sample:
+    """The database queries and template rendering of a sampled request.
+
+    It's used as a database execute wrapper to time the queries.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+# The sample of the current request, if it's sampled.
+current_sample = ContextVar("current_sample", default=None)
+
+
+@contextmanager
+def timing_templates():
+    """Add the time the block takes to the template rendering time
+    of the current sample, if the request is sampled.
+    """
+    sample = current_sample.get()
+    if sample is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample.template_time += time.perf_counter() - start
+
+
+class ViewMetrics:
+    """The totals of the requests of a view."""
+
+    def __init__(self):
+        self.requests = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.duration = 0.0
+        self.response_bytes = 0
+        self.sampled = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+
+
+class Metrics:
+    """Thread-safe totals of the requests of each view (by url name),
+    which can be rendered in Prometheus' text format.
+
+    Every request is counted and timed; queries and templates are only
+    recorded for samples of them.
+    """
+
+    def __init__(self):
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def record(self, view_name, duration, response_bytes, sample=None):
+        with self._lock:
+            view = self._views.get(view_name)
+            if view is None:
+                view = self._views[view_name] = ViewMetrics()
+            view.requests += 1
+            view.buckets[bisect.bisect_left(BUCKETS, duration)] += 1
+            view.duration += duration
+            view.response_bytes += response_bytes
+            if sample is not None:
+                view.sampled += 1
+                view.queries += sample.queries
+                view.db_time += sample.db_time
+                view.template_time += sample.template_time
+
+    def clear(self):
+        with self._lock:
+            self._views = {}
+
+    def render(self):
+        with self._lock:
+            views = sorted(
+                (name, vars(view).copy()) for name, view in self._views.items()
+            )
+        lines = []
+
+        def add_metric(name, kind, help_text, key):
+            lines.append("# HELP msgr_%s %s" % (name, help_text))
+            lines.append("# TYPE msgr_%s %s" % (name, kind))
+            for view_name, view in views:
+                lines.append('msgr_%s{view="%s"} %s' % (
+                    name, escape(view_name), view[key]
+                ))
+
+        add_metric("requests_total", "counter",
+                   "Requests to the view.", "requests")
+        lines.append("# HELP msgr_request_duration_seconds "
+                     "Time it took to respond to the requests.")
+        lines.append("# TYPE msgr_request_duration_seconds histogram")
+        for view_name, view in views:
+            label = escape(view_name)
+            count = 0
+            for bound, bucket in zip(BUCKETS + ("+Inf",), view["buckets"]):
+                count += bucket
+                lines.append(
+                    'msgr_request_duration_seconds_bucket'
+                    '{view="%s",le="%s"} %s' % (label, bound, count)
+                )
+            lines.append('msgr_request_duration_seconds_sum{view="%s"} %s'
+                         % (label, view["duration"]))
+            lines.append('msgr_request_duration_seconds_count{view="%s"} %s'
+                         % (label, view["requests"]))
+        add_metric("response_bytes_total", "counter",
+                   "Size of the response bodies.", "response_bytes")
+        add_metric("sampled_requests_total", "counter",
+                   "Requests whose queries and templates were recorded.",
+                   "sampled")
+        add_metric("db_queries_total", "counter",
+                   "Database queries of the sampled requests.", "queries")
+        add_metric("db_duration_seconds_total", "counter",
+                   "Time the queries of the sampled requests took.",
+                   "db_time")
+        add_metric("template_duration_seconds_total", "counter",
+                   "Time rendering templates took in the sampled requests.",
+                   "template_time")
+        return "\n".join(lines) + "\n"
+
+
+def escape(label_value):
+    return (label_value.replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"))
+
+
+metrics = Metrics()
@@ -1,7 +1,39 @@
+import random
+import time
+from contextlib import ExitStack
 
+from django.conf import settings
 from django.contrib.auth.views import redirect_to_login
 from django.core.exceptions import ImproperlyConfigured
-from django.urls import resolve
+from django.db import connections
+from django.urls import URLResolver, get_resolver
+from django.urls.resolvers import RoutePattern
+
+from .metrics import current_sample, metrics, Sample, timing_templates
+from .routers import PIN_SECONDS, pinned_until
+
+
+def get_app_prefixes(app_name, resolver=None, prefix="/"):
+    """Return the url prefixes that the urls of an app are included at."""
+    if resolver is None:
+        resolver = get_resolver()
+    prefixes = []
+    for pattern in resolver.url_patterns:
+        if not isinstance(pattern, URLResolver):
+            continue
+        route = str(pattern.pattern)
+        if pattern.app_name == app_name:
+            found = [prefix + route]
+        else:
+            found = get_app_prefixes(app_name, pattern, prefix + route)
+        if found and (not isinstance(pattern.pattern, RoutePattern)
+                      or "<" in route):
+            raise ImproperlyConfigured(
+                "Can't find a fixed url prefix for %r in %r."
+                % (app_name, route)
+            )
+        prefixes.extend(found)
+    return prefixes
 
 
 class LoginRequiredMiddleware:
@@ -11,14 +43,105 @@ class LoginRequiredMiddleware:
 
     def __init__(self, get_response):
         self.get_response = get_response
+        # Which urls belong to the app only depends on the urlconf,
+        # so it's found once, and each request only checks a prefix.
+        self.restricted_prefixes = tuple(
+            get_app_prefixes(self.RESTRICTED_APP)
+        )
 
     def __call__(self, request):
         if not hasattr(request, "user"):
             raise ImproperlyConfigured("Requires the django's authentication"
                                        " middleware to be installed.")
 
-        if not request.user.is_authenticated:
-            if resolve(request.path).app_name == self.RESTRICTED_APP:
+        if request.path_info.startswith(self.restricted_prefixes):
+            if not request.user.is_authenticated:
                 return redirect_to_login(request.get_full_path())
 
         return self.get_response(request)
+
+
+class PrimaryPinMiddleware:
+    """Keep reading from the primary database for a while after
+    writing to it, in the next requests too.
+
+    The time until which a client's reads are pinned to the primary
+    is kept in a cookie, so it works across processes.
+    """
+
+    COOKIE_NAME = "primary_until"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            until = float(request.COOKIES.get(self.COOKIE_NAME, 0))
+        except ValueError:
+            until = 0.0
+        token = pinned_until.set(min(until, time.time() + PIN_SECONDS))
+        try:
+            response = self.get_response(request)
+            if pinned_until.get() > until:
+                response.set_cookie(
+                    self.COOKIE_NAME, "%.3f" % pinned_until.get(),
+                    max_age=PIN_SECONDS, httponly=True, samesite="Lax",
+                )
+            return response
+        finally:
+            pinned_until.reset(token)
+
+
+class MetricsMiddleware:
+    """Record the number, latency and response size of the requests
+    to each view; and the queries and template rendering time of a
+    sample of them (METRICS_SAMPLE_RATE), which cost more to record.
+
+    It's opt-in, and should be the first middleware, to time the others.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, "METRICS_SAMPLE_RATE", 0.01)
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            self.record(request, response, time.perf_counter() - start)
+            return response
+
+        sample = Sample()
+        token = current_sample.set(sample)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(sample))
+                start = time.perf_counter()
+                response = self.get_response(request)
+                duration = time.perf_counter() - start
+        finally:
+            current_sample.reset(token)
+        self.record(request, response, duration, sample)
+        return response
+
+    def process_template_response(self, request, response):
+        if current_sample.get() is not None:
+            render = response.render
+
+            def timed_render():
+                with timing_templates():
+                    return render()
+
+            response.render = timed_render
+        return response
+
+    @staticmethod
+    def record(request, response, duration, sample=None):
+        match = request.resolver_match
+        if response.streaming:
+            size = int(response.get("Content-Length", 0))
+        else:
+            size = len(response.content)
+        metrics.record(match.view_name if match else "<unresolved>",
+                       duration, size, sample)
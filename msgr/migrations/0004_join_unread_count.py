@@ -0,0 +1,37 @@
+# Generated by Django 4.0.6 on 2026-10-18 17:45
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_unread_messages(apps, schema_editor):
+    Join = apps.get_model("msgr", "Join")
+    Message = apps.get_model("msgr", "Message")
+    unread_messages = Message.objects.filter(
+        chat=OuterRef("chat"),
+        send_time__gt=OuterRef("last_active"),
+        is_seen=False,
+    ).exclude(
+        sender=OuterRef("user")
+    ).order_by().values("chat").annotate(count=Count("pk"))
+    Join.objects.update(unread_count=Coalesce(
+        Subquery(unread_messages.values("count")), 0
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('msgr', '0003_remove_join_unread_count_join_last_active'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='join',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_unread_messages,
+                             migrations.RunPython.noop),
+    ]
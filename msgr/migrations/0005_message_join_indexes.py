@@ -0,0 +1,33 @@
+# Generated by Django 4.0.6 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('msgr', '0004_join_unread_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='join',
+            index=models.Index(fields=['chat', 'user'], name='join_chat_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'id'], name='message_chat_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'send_time'], name='message_chat_send_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_seen', False)), fields=['chat', 'id'], name='message_unseen_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_seen', True)), fields=['chat', 'sender', 'id'], name='message_seen_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.0.6 on 2026-10-18 17:48
+
+from django.db import migrations, models
+from django.db.models import Exists, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def set_last_read_messages(apps, schema_editor):
+    # A user has read a chat up to the latest seen message of the others.
+    Join = apps.get_model("msgr", "Join")
+    Message = apps.get_model("msgr", "Message")
+    seen_messages = Message.objects.filter(
+        chat=OuterRef("chat"),
+        is_seen=True,
+    ).exclude(
+        sender=OuterRef("user")
+    ).order_by().values("chat").annotate(latest_pk=Max("pk"))
+    Join.objects.update(last_read_message_id=Coalesce(
+        Subquery(seen_messages.values("latest_pk")), 0
+    ))
+
+
+def set_seen_messages(apps, schema_editor):
+    # A message is seen if anyone else has read the chat up to it.
+    Join = apps.get_model("msgr", "Join")
+    Message = apps.get_model("msgr", "Message")
+    Message.objects.update(is_seen=Exists(Join.objects.filter(
+        chat=OuterRef("chat"),
+        last_read_message_id__gte=OuterRef("pk"),
+    ).exclude(user=OuterRef("sender"))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('msgr', '0005_message_join_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='join',
+            name='last_read_message_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(set_last_read_messages, set_seen_messages),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_unseen_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_seen_idx',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_seen',
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'sender', 'id'], name='message_chat_sender_id_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:20
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX message_content_fts_idx ON msgr_message "
+            "USING gin (to_tsvector('simple', content))"
+        )
+    elif vendor == "sqlite":
+        # The table only indexes the content of msgr_message.
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE msgr_message_fts USING fts5("
+            "content, content='msgr_message', content_rowid='id')"
+        )
+        schema_editor.execute(
+            "INSERT INTO msgr_message_fts (msgr_message_fts) "
+            "VALUES ('rebuild')"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS message_content_fts_idx")
+    elif vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS msgr_message_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('msgr', '0006_join_last_read_message'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:00
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+import django.db.models.deletion
+
+
+def set_private_pairs(apps, schema_editor):
+    """Set the pair of users of each chat, and merge the duplicate chats
+    of each pair into the oldest one.
+
+    Chats had no type, so any chat with one or two participants is taken
+    to be private (or a "saved messages" one), and the others to be
+    groups. Merging can't be undone; reversing it leaves chats merged.
+    """
+    Chat = apps.get_model("msgr", "Chat")
+    Join = apps.get_model("msgr", "Join")
+    Message = apps.get_model("msgr", "Message")
+
+    participants = defaultdict(set)
+    for chat_id, user_id in Join.objects.values_list("chat", "user"):
+        participants[chat_id].add(user_id)
+    chats_by_pair = defaultdict(list)
+    for chat_id, user_ids in sorted(participants.items()):
+        if len(user_ids) in (1, 2):
+            chats_by_pair[min(user_ids), max(user_ids)].append(chat_id)
+
+    for (low_user, high_user), (chat_id, *duplicates) in chats_by_pair.items():
+        if duplicates:
+            Message.objects.filter(chat__in=duplicates).update(chat=chat_id)
+            for join in Join.objects.filter(chat=chat_id):
+                joins = Join.objects.filter(chat__in=[chat_id, *duplicates],
+                                            user=join.user_id)
+                merged = joins.aggregate(Max("last_active"),
+                                         Max("last_read_message_id"))
+                join.last_active = merged["last_active__max"]
+                join.last_read_message_id = merged["last_read_message_id__max"]
+                join.unread_count = Message.objects.filter(
+                    chat=chat_id,
+                    send_time__gt=join.last_active,
+                    pk__gt=join.last_read_message_id,
+                ).exclude(sender=join.user_id).count()
+                join.save()
+            lat = Chat.objects.filter(
+                pk__in=[chat_id, *duplicates]
+            ).aggregate(Max("lat"))["lat__max"]
+            Chat.objects.filter(pk__in=duplicates).delete()
+            Chat.objects.filter(pk=chat_id).update(lat=lat)
+        Chat.objects.filter(pk=chat_id).update(low_user=low_user,
+                                               high_user=high_user)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('msgr', '0007_message_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='high_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='low_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(set_private_pairs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chat',
+            constraint=models.UniqueConstraint(fields=('low_user', 'high_user'), name='private_chat_once_constraint'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('msgr', '0008_chat_private_pair'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='send_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
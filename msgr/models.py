@@ -1,8 +1,29 @@
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
 
+from .writebehind import WriteBehindBuffer
+
+
+class ChatManager(models.Manager):
+
+    def get_or_create_private(self, user, other):
+        """Return the private chat between two users (or a user's
+        "saved messages" chat, if they're the same), creating it
+        if it doesn't exist; and whether it was created.
+        """
+        low_user, high_user = sorted([user, other], key=lambda u: u.pk)
+        with transaction.atomic():
+            # Concurrent creations are prevented by the unique constraint.
+            chat, created = self.get_or_create(low_user=low_user,
+                                               high_user=high_user)
+            if created:
+                chat.participants.set({user, other})
+        return chat, created
+
 
 class Chat(models.Model):
     """Parent model representing a chat between multiple users.
@@ -15,11 +36,90 @@ class Chat(models.Model):
                                           through="Join", blank=True,
                                           related_name="chats")
     lat = models.DateTimeField("latest activity time", default=timezone.now)
+    # The participants of a private chat, the one with the lower primary
+    # key first; both are the same user in the "saved messages" chat.
+    low_user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                                 on_delete=models.SET_NULL,
+                                 blank=True, null=True, related_name="+")
+    high_user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                                  on_delete=models.SET_NULL,
+                                  blank=True, null=True, related_name="+")
+
+    objects = ChatManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("low_user", "high_user"),
+                name="private_chat_once_constraint"
+            )
+        ]
 
     def update_lat(self):
-        """Set latest activity time of the chat to now."""
+        """Set latest activity time of the chat to now.
+
+        It's written to the database within a few seconds,
+        along with the others.
+        """
         self.lat = timezone.now()
-        self.save()
+        lat_updates.add(self.pk, self.lat)
+
+    def add_unread(self, message, count=1):
+        """Count a new message (or a number of them by the same sender)
+        as unread for everyone except its sender.
+        """
+        Join.objects.filter(chat=self).exclude(user=message.sender_id).update(
+            unread_count=F("unread_count") + count
+        )
+
+    def remove_unread(self, message):
+        """Stop counting a deleted message as unread
+        for those who haven't read it.
+        """
+        Join.objects.filter(
+            chat=self,
+            unread_count__gt=0,
+            last_read_message_id__lt=message.pk,
+        ).exclude(user=message.sender_id).update(
+            unread_count=F("unread_count") - 1
+        )
+
+    def mark_read(self, user, message_pk):
+        """Mark all messages of the chat up to the given one
+        as read for the user.
+
+        Return whether it was new to the user.
+        """
+        # Messages after the given one (e.g. when jumping to an old
+        # one) are still unread; so only the newly read ones that were
+        # counted (see the unread_counts command) are subtracted.
+        newly_read = Message.objects.filter(
+            chat=self,
+            pk__gt=OuterRef("last_read_message_id"),
+            pk__lte=message_pk,
+            send_time__gt=OuterRef("last_active"),
+        ).exclude(
+            sender=user
+        ).order_by().values("chat").annotate(count=Count("pk"))
+        return bool(Join.objects.filter(
+            chat=self, user=user, last_read_message_id__lt=message_pk
+        ).update(
+            last_read_message_id=message_pk,
+            unread_count=Greatest(
+                F("unread_count")
+                - Coalesce(Subquery(newly_read.values("count")), 0),
+                Value(0),
+            ),
+        ))
+
+    def get_read_pk(self, user):
+        """Return primary key of the latest message that
+        the other participants have read.
+        """
+        read_pk = Join.objects.filter(chat=self).exclude(user=user).aggregate(
+            Max("last_read_message_id")
+        )["last_read_message_id__max"]
+        return read_pk or 0
 
     def __str__(self) -> str:
         return "chat object (%s)" % self.pk
@@ -34,6 +134,10 @@ class Join(models.Model):
                              related_name="joins")
     date_joined = models.DateField(auto_now_add=True)
     last_active = models.DateTimeField(default=timezone.now)
+    unread_count = models.PositiveIntegerField(default=0)
+    # Primary key of the latest message in the chat that the user has
+    # read; messages are seen by the user up to this one.
+    last_read_message_id = models.BigIntegerField(default=0)
 
     class Meta:
         constraints = [
@@ -42,6 +146,10 @@ class Join(models.Model):
                 name="user_join_once_constraint"
             )
         ]
+        indexes = [
+            # Finding the other participants of a chat.
+            models.Index(fields=["chat", "user"], name="join_chat_user_idx"),
+        ]
 
     def get_receivers(self):
         """Return all other users that are in the same chat."""
@@ -61,15 +169,19 @@ class Join(models.Model):
         """Return number of messages that has been sent since
         the last time user was in the chat.
         """
-        unread_messages = self.chat.messages.filter(
-            send_time__gt=self.last_active
-        )
-        return unread_messages.count()
+        return self.unread_count
 
     def update_last_active(self):
-        """Set the last time user was in this chat to now."""
+        """Set the last time user was in this chat to now,
+        which means all its messages have been read.
+        """
         self.last_active = timezone.now()
-        self.save()
+        # It's written to the database within a few seconds,
+        # along with the others.
+        last_active_updates.add(self.pk, self.last_active)
+        if self.unread_count:
+            self.unread_count = 0
+            Join.objects.filter(pk=self.pk).update(unread_count=0)
 
 
 class Message(models.Model):
@@ -85,11 +197,22 @@ class Message(models.Model):
                                on_delete=models.CASCADE,
                                related_name="+")
     content = models.TextField()
-    send_time = models.DateTimeField(auto_now_add=True)
-    is_seen = models.BooleanField(default=False)
+    # Set when it's sent, but imported messages keep their own.
+    send_time = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ["send_time"]
+        indexes = [
+            # New messages and history pages of a chat.
+            models.Index(fields=["chat", "id"],
+                         name="message_chat_id_idx"),
+            # Messages of a chat in their default ordering.
+            models.Index(fields=["chat", "send_time"],
+                         name="message_chat_send_time_idx"),
+            # Messages of a sender, for the seen status check marks.
+            models.Index(fields=["chat", "sender", "id"],
+                         name="message_chat_sender_id_idx"),
+        ]
 
     def __str__(self) -> str:
         return "message (%s) by %s in chat (%s)" % (
@@ -97,3 +220,36 @@ class Message(models.Model):
             self.sender.get_username(),
             self.chat.pk
         )
+
+
+class ArchivedMessage(models.Model):
+    """A message moved out of the messages table when it got old,
+    by the archive_messages command.
+
+    It keeps its primary key, and those of a chat's archived messages
+    are all lower than the ones of its messages that aren't archived.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE,
+                             related_name="archived_messages")
+    sender = models.ForeignKey(settings.AUTH_USER_MODEL,
+                               on_delete=models.CASCADE,
+                               related_name="+")
+    content = models.TextField()
+    send_time = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # History pages of a chat.
+            models.Index(fields=["chat", "id"],
+                         name="archived_message_chat_id_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return "archived message (%s) in chat (%s)" % (self.pk, self.chat_id)
+
+
+# Activity times are updated often, so their updates are coalesced.
+lat_updates = WriteBehindBuffer(Chat, "lat")
+last_active_updates = WriteBehindBuffer(Join, "last_active")
@@ -0,0 +1,83 @@
+import math
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# Seconds that reads go to the primary database after a write,
+# which should be longer than the replicas take to catch up.
+PIN_SECONDS = 5
+
+# Until when (a unix timestamp) the reads of the current request,
+# thread or task go to the primary database.
+pinned_until = ContextVar("pinned_until", default=0.0)
+
+
+def pin_primary():
+    """Read from the primary database for the next PIN_SECONDS."""
+    pinned_until.set(time.time() + PIN_SECONDS)
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary database within the block; e.g. right after
+    being told of a write that the replicas may not have yet.
+    """
+    token = pinned_until.set(math.inf)
+    try:
+        yield
+    finally:
+        pinned_until.reset(token)
+
+
+def is_pinned():
+    return pinned_until.get() > time.time()
+
+
+def get_replicas():
+    """Return the database aliases of the replicas, from the
+    DATABASE_REPLICAS setting.
+    """
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+class ReplicaRouter:
+    """Send reads to the replicas of the default database, and writes
+    to the default (primary) one.
+
+    Whoever writes reads from the primary for a while afterwards, so they
+    see their writes (e.g. their own messages) even if the replicas
+    lag behind. Reads in transactions go to the primary too, and so do
+    sessions, which are written after most of the requests' reads.
+    """
+
+    PRIMARY_APPS = {"sessions"}
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if (not replicas or is_pinned()
+                or model._meta.app_label in self.PRIMARY_APPS
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if get_replicas():
+            pin_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their tables (and data) from the primary.
+        if db in get_replicas():
+            return False
+        return None
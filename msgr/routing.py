@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import consumers
+
+
+urlpatterns = [
+    path("chats/<int:pk>/ws/",
+         consumers.ChatConsumer.as_asgi(),
+         name="chat_ws"),
+]
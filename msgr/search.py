@@ -0,0 +1,141 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Join, Message
+
+
+# Most results a search can have, the latest messages first.
+MAX_RESULTS = 200
+
+
+def get_words(query):
+    return re.findall(r"\w+", query)
+
+
+class FTS5Backend:
+    """Search with an SQLite FTS5 table (msgr_message_fts),
+    which indexes the content of the messages table.
+
+    Backends index and unindex messages, and make the subquery
+    of the primary keys of the messages that match a query.
+    """
+
+    table = "msgr_message_fts"
+
+    def index(self, messages):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO %s (rowid, content) VALUES (%%s, %%s)"
+                % self.table,
+                [(m.pk, m.content) for m in messages],
+            )
+
+    def remove(self, messages):
+        # An external content table needs the content to remove it.
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO %s (%s, rowid, content) "
+                "VALUES ('delete', %%s, %%s)" % (self.table, self.table),
+                [(m.pk, m.content) for m in messages],
+            )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO %s (%s) VALUES ('rebuild')"
+                           % (self.table, self.table))
+
+    def get_matches(self, query):
+        # Each word as a quoted string, so nothing in the query
+        # is taken as the syntax of FTS5.
+        match = " ".join('"%s"' % word for word in get_words(query))
+        return RawSQL(
+            "SELECT rowid FROM %s WHERE %s MATCH %%s"
+            % (self.table, self.table),
+            [match],
+        )
+
+
+class PostgresBackend:
+    """Search with PostgreSQL's full text search, and a GIN index
+    of the text search vectors of the messages.
+    """
+
+    def index(self, messages):
+        # The database keeps its index up to date itself.
+        pass
+
+    def remove(self, messages):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def get_matches(self, query):
+        # This should be the same expression as the one indexed.
+        return RawSQL(
+            "SELECT id FROM msgr_message "
+            "WHERE to_tsvector('simple', content) "
+            "@@ plainto_tsquery('simple', %s)",
+            [query],
+        )
+
+
+class ContainsBackend:
+    """Search without an index, on databases that have none of the others."""
+
+    def index(self, messages):
+        pass
+
+    def remove(self, messages):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def get_matches(self, query):
+        queryset = Message.objects.all()
+        for word in get_words(query):
+            queryset = queryset.filter(content__icontains=word)
+        return queryset.values("pk")
+
+
+def get_backend():
+    if connection.vendor == "postgresql":
+        return PostgresBackend()
+    if connection.vendor == "sqlite":
+        return FTS5Backend()
+    return ContainsBackend()
+
+
+def index_messages(messages):
+    """Add new messages to the index."""
+    get_backend().index(messages)
+
+
+def remove_messages(messages):
+    """Remove messages (before or after they're deleted) from the index."""
+    get_backend().remove(messages)
+
+
+def rebuild_index():
+    """Index all of the messages again; e.g. after adding
+    many of them without indexing them.
+    """
+    get_backend().rebuild()
+
+
+def search_messages(query, user, chat=None):
+    """Return the latest messages that contain the words of the query,
+    from the chats that the user has joined (or just one of them).
+    """
+    if not get_words(query):
+        return Message.objects.none()
+    messages = Message.objects.filter(
+        pk__in=get_backend().get_matches(query),
+        chat__in=Join.objects.filter(user=user).values("chat"),
+    )
+    if chat is not None:
+        messages = messages.filter(chat=chat)
+    return messages.order_by("-pk")[:MAX_RESULTS]
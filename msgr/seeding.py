@@ -0,0 +1,171 @@
+import csv
+import io
+import itertools
+import random
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from accounts.models import User, Profile
+from accounts.search import index_profiles
+from .models import Chat, Join, Message
+from .search import rebuild_index
+
+
+# Password of all the seeded users.
+PASSWORD = "password"
+# Messages are spread over the days up to this time, the same every time.
+END_TIME = datetime(2022, 7, 1, tzinfo=timezone.utc)
+
+FIRST_NAMES = [
+    "ali", "sara", "reza", "maryam", "john", "emma", "omid", "nina",
+    "david", "zahra", "peter", "laura", "amir", "julia", "hamid", "anna",
+]
+LAST_NAMES = [
+    "", "", "smith", "jones", "ahmadi", "brown", "karimi", "miller",
+    "rezaei", "wilson", "moradi", "taylor",
+]
+WORDS = [
+    "hi", "hello", "yes", "no", "ok", "thanks", "see", "you", "tomorrow",
+    "today", "meeting", "lunch", "call", "me", "later", "where", "are",
+    "the", "file", "sent", "it", "good", "morning", "night", "what",
+    "about", "project", "done", "soon", "please", "check", "this", "link",
+]
+
+
+def seed_database(users, chats_per_user, messages, seed=0, groups=0,
+                  max_group_size=20, mention_rate=0.0, days=365,
+                  batch_size=1000, log=None):
+    """Fill the database with users, private chats, group chats and
+    messages; the same ones for the same arguments.
+
+    Rows are inserted in bulk, which skips their signals, so whatever
+    the signals do (e.g. creating profiles) is done here as well.
+    Some chats are much busier than others, and mention_rate of the
+    messages mention members of their chats.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    step = timedelta(days=days) / max(messages, 1)
+    start_time = END_TIME - step * messages
+
+    log("Creating %s users..." % users)
+    # A single hash for everyone; hashing is slow on purpose.
+    password = make_password(PASSWORD)
+    user_list = User.objects.bulk_create([
+        User(email="user%s@example.com" % i, password=password)
+        for i in range(users)
+    ], batch_size=batch_size)
+    profiles = [
+        Profile(user=user, first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES), identifier="user%s" % i)
+        for i, user in enumerate(user_list)
+    ]
+    for profile in profiles:
+        profile.search_text = profile.get_search_text()
+    profiles = Profile.objects.bulk_create(profiles, batch_size=batch_size)
+    for i in range(0, len(profiles), batch_size):
+        index_profiles(profiles[i:i + batch_size])
+    identifiers = {p.user_id: p.identifier for p in profiles}
+
+    log("Creating chats...")
+    pairs = set()
+    for user in user_list:
+        for other in rng.sample(user_list, chats_per_user):
+            pairs.add(tuple(sorted((user.pk, other.pk))))
+    # The members of each chat; private ones first.
+    members = [sorted(set(pair)) for pair in sorted(pairs)]
+    chat_list = [Chat(low_user_id=pair[0], high_user_id=pair[-1],
+                      lat=start_time)
+                 for pair in members]
+    for _ in range(groups):
+        size = min(rng.randint(3, max(3, max_group_size)), users)
+        members.append(sorted(u.pk for u in rng.sample(user_list, size)))
+        chat_list.append(Chat(lat=start_time))
+    chat_list = Chat.objects.bulk_create(chat_list, batch_size=batch_size)
+    # Everyone was last active after the last message; so none of them
+    # count as unread.
+    joins = [Join(chat=chat, user_id=user_id, last_active=END_TIME)
+             for chat, user_ids in zip(chat_list, members)
+             for user_id in user_ids]
+    Join.objects.bulk_create(joins, batch_size=batch_size)
+
+    log("Creating %s messages..." % messages)
+    # Chats get messages by a power law of their (random) rank.
+    ranks = list(range(len(chat_list)))
+    rng.shuffle(ranks)
+    cum_weights = list(itertools.accumulate(
+        1 / (rank + 1) ** 0.8 for rank in ranks
+    ))
+    # Numbers of the latest few messages of each chat.
+    latest = [deque(maxlen=10) for _ in chat_list]
+    for first in range(0, messages, batch_size):
+        count = min(batch_size, messages - first)
+        rows = []
+        for i, j in enumerate(rng.choices(range(len(chat_list)),
+                                          cum_weights=cum_weights,
+                                          k=count), first):
+            sender_id = rng.choice(members[j])
+            words = rng.choices(WORDS, k=rng.randint(1, 12))
+            if rng.random() < mention_rate:
+                words.insert(rng.randrange(len(words) + 1),
+                             "@" + identifiers[rng.choice(members[j])])
+            rows.append((chat_list[j].pk, sender_id,
+                         "message %s: %s" % (i, " ".join(words)),
+                         start_time + step * i))
+            latest[j].append(i)
+        insert_messages(rows)
+        if first and first % (batch_size * 100) == 0:
+            log("%s messages..." % first)
+    # They're added without being indexed, so the index is made at once.
+    log("Indexing messages...")
+    rebuild_index()
+
+    log("Updating chats...")
+    Chat.objects.update(lat=Coalesce(Subquery(
+        Message.objects.filter(chat=OuterRef("pk")).order_by().values(
+            "chat"
+        ).annotate(latest=Max("send_time")).values("latest")
+    ), "lat"))
+    # Everyone has read most of their chats; messages got consecutive
+    # primary keys in the order they were made.
+    first_pk = Message.objects.order_by("pk").values_list(
+        "pk", flat=True
+    ).first() or 0
+    for join, j in zip(joins, (j for j, user_ids in enumerate(members)
+                               for _ in user_ids)):
+        if latest[j]:
+            if rng.random() < 0.8:
+                join.last_read_message_id = first_pk + latest[j][-1]
+            else:
+                join.last_read_message_id = first_pk + rng.choice(latest[j])
+    Join.objects.bulk_update(joins, ["last_read_message_id"],
+                             batch_size=batch_size)
+
+
+def insert_messages(rows):
+    """Insert messages from (chat_id, sender_id, content, send_time) rows;
+    with COPY on PostgreSQL, which is much faster than INSERT.
+    """
+    if connection.vendor == "postgresql":
+        f = io.StringIO()
+        csv.writer(f).writerows(rows)
+        f.seek(0)
+        columns = ", ".join(
+            connection.ops.quote_name(Message._meta.get_field(name).column)
+            for name in ("chat", "sender", "content", "send_time")
+        )
+        with connection.cursor() as cursor:
+            cursor.copy_expert("COPY %s (%s) FROM STDIN WITH (FORMAT csv)" % (
+                connection.ops.quote_name(Message._meta.db_table), columns,
+            ), f)
+    else:
+        Message.objects.bulk_create([
+            Message(chat_id=chat_id, sender_id=sender_id, content=content,
+                    send_time=send_time)
+            for chat_id, sender_id, content, send_time in rows
+        ])
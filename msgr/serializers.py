@@ -0,0 +1,42 @@
+from .mentions import MENTION_RE, resolve_mentions
+from accounts.models import Profile
+
+
+def serialize_messages(message_list, read_pk):
+    """Return compact json-able data of the messages,
+    for the clients to render them.
+
+    Each message is a list of its primary key, sender's id, content,
+    send time (as a unix timestamp), whether it's been seen, based on
+    read_pk (the latest message others have seen), and the IDs it
+    mentions in order; so that clients don't need to find mentions the
+    same way. Profiles of senders and users mentioned in the messages
+    are included once, separately.
+    """
+    data = {"messages": [], "profiles": {}, "mentions": {}}
+    if not message_list:
+        return data
+
+    for m in message_list:
+        data["messages"].append([
+            m.pk,
+            m.sender_id,
+            m.content,
+            int(m.send_time.timestamp()),
+            m.pk <= read_pk,
+            MENTION_RE.findall(m.content),
+        ])
+    # Profile primary keys and short names of the senders, by user id.
+    profiles = Profile.objects.filter(
+        user__in={m.sender_id for m in message_list}
+    ).only("pk", "user", "first_name")
+    for profile in profiles:
+        data["profiles"][profile.user_id] = [profile.pk,
+                                             profile.get_short_name()]
+    # Profile primary keys of the mentioned users, by their lowercase IDs.
+    for identifier, pk in resolve_mentions(
+        [m.content for m in message_list]
+    ).items():
+        if pk:
+            data["mentions"][identifier] = pk
+    return data
@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import fragments, search
+from .membership import forget_membership
+from .mentions import forget_profile
+from .models import Chat, Join, Message
+from accounts.models import Profile
+
+
+@receiver(post_save, sender=Profile)
+def forget_profile_mentions(sender, instance, created, **kwargs):
+    """Forget the cached mentions of a profile if its ID has changed;
+    profiles are saved whenever their users are (e.g. on every login).
+    """
+    loaded_values = getattr(instance, "_loaded_values", {})
+    if (created or "identifier" not in loaded_values
+            or loaded_values["identifier"] != instance.identifier):
+        forget_profile(instance, created)
+
+
+@receiver(post_delete, sender=Profile)
+def forget_deleted_profile_mentions(sender, instance, **kwargs):
+    forget_profile(instance)
+
+
+@receiver(post_save, sender=Profile)
+def forget_rendered_messages(sender, instance, created, **kwargs):
+    """Invalidate rendered messages if the way the user appears
+    in them (their name or ID) has changed.
+    """
+    if created:
+        return
+    loaded_values = getattr(instance, "_loaded_values", {})
+    for field in ("first_name", "identifier"):
+        if loaded_values.get(field) != getattr(instance, field):
+            fragments.bump_version()
+            return
+
+
+@receiver(post_save, sender=Message)
+def index_message(sender, instance, created, **kwargs):
+    if created:
+        search.index_messages([instance])
+
+
+@receiver(post_delete, sender=Message)
+def remove_message_from_index(sender, instance, **kwargs):
+    search.remove_messages([instance])
+
+
+def forget_memberships(pairs):
+    """Forget memberships of (user_id, chat_id) pairs now, and again once
+    the transaction is committed, in case they were cached in between.
+    """
+    pairs = list(pairs)
+
+    def forget():
+        for user_id, chat_id in pairs:
+            forget_membership(user_id, chat_id)
+
+    forget()
+    transaction.on_commit(forget)
+
+
+@receiver(post_save, sender=Join)
+@receiver(post_delete, sender=Join)
+def forget_join(sender, instance, **kwargs):
+    if kwargs.get("created", True):
+        forget_memberships([(instance.user_id, instance.chat_id)])
+
+
+@receiver(m2m_changed, sender=Chat.participants.through)
+def forget_participants(sender, instance, action, reverse, pk_set, **kwargs):
+    """Joins added or removed through the participants relationship
+    don't send their own signals.
+    """
+    if action == "pre_clear":
+        if reverse:
+            pk_set = set(instance.joins.values_list("chat", flat=True))
+        else:
+            pk_set = set(instance.participants.values_list("pk", flat=True))
+    elif action not in ("post_add", "post_remove"):
+        return
+    if reverse:
+        forget_memberships((instance.pk, pk) for pk in pk_set)
+    else:
+        forget_memberships((pk, instance.pk) for pk in pk_set)
@@ -1,25 +1,88 @@
 
 var latest_pk = 0;
 var latest_seen_pk = 0;
+var polling = true;
+// Seconds for the server to hold a polling request until there are updates.
+var poll_wait = 25;
+
+function show_new_messages(data) {
+    // Leave out the ones already shown, e.g. ones the websocket delivered
+    // while the catch-up request was on its way.
+    var messages = data.messages.filter(m => m[0] > latest_pk);
+    if (!messages.length) {
+        return;
+    }
+    var messages_rendered = render_messages($.extend({}, data, {messages: messages}));
+    $('#messages-list').prepend(messages_rendered);
+    add_date_headers(messages_rendered);
+}
+
+function show_seen_messages(seen_messages_pk) {
+    for (let pk of seen_messages_pk) {
+        $('#tick-'+pk).text('✓✓');
+    }
+}
 
 function get_updates() {
     $.ajax({
         url: updates_path,
         type: 'GET',
-        data: {latest_pk: latest_pk, latest_seen_pk: latest_seen_pk},
+        data: {
+            latest_pk: latest_pk,
+            latest_seen_pk: latest_seen_pk,
+            wait: polling ? poll_wait : 0,
+        },
 
         success: function(json) {
-            $('#messages-list').prepend(json.new_messages_rendered);
-            add_date_headers(json.new_messages_rendered);
-            for (let pk of json.seen_messages_pk) {
-                $('#tick-'+pk).text('✓✓');
-            }
-            latest_pk = json.latest_pk;
-            latest_seen_pk = json.latest_seen_pk;
+            show_new_messages(json);
+            show_seen_messages(json.seen_messages_pk);
+            latest_pk = Math.max(latest_pk, Number(json.latest_pk));
+            latest_seen_pk = Math.max(latest_seen_pk,
+                                      Number(json.latest_seen_pk));
         },
 
-        complete: function(data) {
-            setTimeout(get_updates, 1000);
+        complete: function(data, status) {
+            if (polling) {
+                // Ask again right away, unless something went wrong.
+                setTimeout(get_updates, (status == 'success') ? 0 : 1000);
+            }
         }
     });
 }
+
+function start_updates() {
+    // Get the updates pushed through a websocket if possible,
+    // and fall back to polling if it's not.
+    if (!('WebSocket' in window)) {
+        get_updates();
+        return;
+    }
+    var scheme = (window.location.protocol == 'https:') ? 'wss://' : 'ws://';
+    var socket = new WebSocket(scheme + window.location.host + socket_path);
+
+    socket.onopen = function() {
+        polling = false;
+        // Catch up with whatever happened before the connection.
+        get_updates();
+    };
+
+    socket.onmessage = function(event) {
+        var data = JSON.parse(event.data);
+        if (data.type == 'messages') {
+            if (data.latest_pk > latest_pk) {
+                show_new_messages(data);
+                latest_pk = data.latest_pk;
+            }
+        } else if (data.type == 'seen') {
+            show_seen_messages(data.seen_messages_pk);
+        } else if (data.type == 'delete') {
+            $('#m-'+data.pk).remove();
+        }
+    };
+
+    socket.onclose = function() {
+        // Whether it was disconnected or never connected at all.
+        polling = true;
+        get_updates();
+    };
+}
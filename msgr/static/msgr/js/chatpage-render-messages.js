@@ -0,0 +1,60 @@
+
+// Times are shown in the server's time zone, like the pages it renders.
+var date_format = new Intl.DateTimeFormat('en-US', {
+    month: 'long', day: '2-digit', timeZone: time_zone,
+});
+var time_format = new Intl.DateTimeFormat('en-GB', {
+    hour: '2-digit', minute: '2-digit', hourCycle: 'h23', timeZone: time_zone,
+});
+
+function escape_html(text) {
+    return $('<div>').text(text).html();
+}
+
+function profile_url(pk) {
+    return profile_path.replace('/0/', '/' + pk + '/');
+}
+
+function render_content(content, identifiers, mentions) {
+    // Convert mentions to links to profiles of the users (if exist).
+    // The server finds the mentioned IDs, in order; each is where its
+    // '@' first appears after the previous one.
+    var html = '';
+    var start = 0;
+    for (let identifier of identifiers) {
+        var match = '@' + identifier;
+        var index = content.indexOf(match, start);
+        var pk = mentions[identifier.toLowerCase()];
+        var url = pk ? profile_url(pk) : '';
+        html += escape_html(content.slice(start, index))
+            + '<a href="' + url + '">' + escape_html(match) + '</a>';
+        start = index + match.length;
+    }
+    return html + escape_html(content.slice(start));
+}
+
+function render_messages(data) {
+    // Render html of the messages, in the
+    // compact form that the server sends them.
+    var html = '';
+    for (let [pk, sender, content, timestamp, seen, identifiers] of data.messages) {
+        var send_time = new Date(timestamp * 1000);
+        if (sender == user_pk) {
+            html += '<div onclick="open_modal(\'' + pk + '\')" id="m-' + pk + '" class="message right">';
+        } else {
+            var profile = data.profiles[sender];
+            html += '<div id="m-' + pk + '" class="message left">'
+                + '<a href="' + profile_url(profile[0]) + '" class="profile-link">'
+                + '<b>' + escape_html(profile[1]) + ':</b></a>';
+        }
+        html += '<pre>' + render_content(content, identifiers, data.mentions) + '</pre>'
+            + '<span hidden class="m-date">' + date_format.format(send_time) + '</span>'
+            + '<span class="detail"><sub class="m-time">'
+            + time_format.format(send_time) + '</sub>';
+        if (sender == user_pk) {
+            html += '<sub id="tick-' + pk + '">' + (seen ? '✓✓' : '✓') + '</sub>';
+        }
+        html += '</span></div>';
+    }
+    return html;
+}
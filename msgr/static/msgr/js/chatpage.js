@@ -6,22 +6,85 @@ $(window).on('visibilitychange', function(event) {
 });
 
 
-var page = 1;
+var before_pk = null;
+var has_more = true;
+// When the page starts around a message (around_pk), the newer
+// messages are loaded by scrolling up, before getting updates.
+var after_pk = null;
+var has_newer = false;
+var loading = false;
 
 function load_messages() {
+    if (loading || !has_more) {
+        return;
+    }
+    loading = true;
+    var data = {};
+    if (before_pk !== null) {
+        data = {before_pk: before_pk};
+    } else if (around_pk !== null) {
+        data = {around_pk: around_pk};
+    }
+    $.ajax({
+        url: messages_path,
+        type: 'GET',
+        data: data,
+
+        success: function(json) {
+            var messages_rendered = render_messages(json);
+            $('#messages-list').append(messages_rendered);
+            add_date_headers(messages_rendered);
+            if (before_pk === null) {
+                after_pk = json.first_item_pk;
+                has_newer = json.has_newer;
+                var found = $('#m-'+around_pk);
+                if (found.length) {
+                    found.addClass('found');
+                    found.get(0).scrollIntoView({block: 'center'});
+                }
+                if (!has_newer) {
+                    latest_pk = json.first_item_pk;
+                    start_updates();
+                }
+            }
+            before_pk = json.last_item_pk;
+            has_more = json.has_more;
+        },
+
+        complete: function() {
+            loading = false;
+        }
+    });
+}
+
+function load_newer_messages() {
+    if (loading || !has_newer) {
+        return;
+    }
+    loading = true;
     $.ajax({
         url: messages_path,
         type: 'GET',
-        data: {page: page},
+        data: {after_pk: after_pk},
 
         success: function(json) {
-            $('#messages-list').append(json.messages_rendered);
-            add_date_headers(json.messages_rendered);
-            if (page == 1) {
-                latest_pk = json.first_item_pk;
-                get_updates();
+            // Keep the messages on screen where they are.
+            var height = $(document).height();
+            show_new_messages(json);
+            $(window).scrollTop($(window).scrollTop() + $(document).height() - height);
+            if (json.messages.length) {
+                after_pk = json.first_item_pk;
+            }
+            has_newer = json.has_newer;
+            if (!has_newer) {
+                latest_pk = after_pk;
+                start_updates();
             }
         },
+
+        complete: function() {
+            loading = false;
+        }
     });
 }
 
@@ -31,7 +94,8 @@ $(document).ready(function() {
 
 $(window).scroll(function() {
     if ($(window).scrollTop() >= ($(document).height() - $(window).outerHeight(true) - 1)) {
-        page += 1;
         load_messages();
+    } else if ($(window).scrollTop() <= 0) {
+        load_newer_messages();
     }
 });
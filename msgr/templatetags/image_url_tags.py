@@ -1,45 +1,65 @@
-
-from pathlib import Path
-
 from django import template
 from django.conf import settings
-from PIL import Image
 
 
 register = template.Library()
 
 
+def get_variants(profile, size):
+    """Return urls of the variants of a profile's picture by format,
+    as lists of (url, size) from the smallest one that fits the size up;
+    or an empty dictionary if there are none that fit.
+    """
+    variants = profile.picture_variants if profile.picture else {}
+    if not variants:
+        return {}
+    # The smallest variant that isn't smaller than needed, and larger
+    # ones for screens with more pixels, but none larger than 4 times.
+    fitting = sorted(s for s in map(int, variants) if s >= size)
+    if not fitting:
+        # The original picture is better than a blurry one.
+        return {}
+    fitting = [s for s in fitting if s <= fitting[0] * 4]
+    storage = profile.picture.storage
+    return {
+        variant_format: [
+            (storage.url(variants[str(s)][variant_format]), s)
+            for s in fitting
+        ]
+        for variant_format in variants[str(fitting[0])]
+    }
+
+
 @register.simple_tag
-def get_profile_pic(pic, thumbnail=False):
-    """Return url of a suitable profile picture for a user."""
+def get_profile_pic(profile, size=None):
+    """Return url of a suitable profile picture for a user;
+    of a variant that fits the size (in pixels), if it's given.
+    """
 
-    if pic:
+    if size:
+        # The variant of the picture, if it's ready:
+        variants = get_variants(profile, size)
+        if variants:
+            return variants["jpeg"][0][0]
+    if profile.picture:
         # The profile picture, if user has one:
-        pic_name = pic.name
+        return profile.picture.url
     else:
         # Or if they don't, the default picture:
-        pic_name = "profile_pics/avatar.png"
-    pic_name = Path(pic_name)
-
-    # If the picture is needed as a thumbnail:
-    if thumbnail:
-        # Thumbnail has the same name as the original picture,
-        # but it's in the 'thumbnails' subfolder.
-        pic_parts = list(pic_name.parts)
-        pic_parts.insert(-1, "thumbnails")
-        thumbnail_name = Path(*pic_parts)
-        thumbnail_path = settings.MEDIA_ROOT / thumbnail_name
-        pic_path = settings.MEDIA_ROOT / pic_name
-        pic_name = thumbnail_name
-
-        if not thumbnail_path.exists():
-            # Create the thumbnail if it doesn't exist;
-            # and save it for future use.
-            pic = Image.open(pic_path)
-            # Its size should be so that the smaller side is 30px.
-            r = max(pic.size) / min(pic.size) * 30
-            pic.thumbnail((r, r))
-            pic.save(thumbnail_path)
-
-    url = settings.MEDIA_URL / pic_name
-    return url
+        return settings.MEDIA_URL + "profile_pics/avatar.png"
+
+
+@register.inclusion_tag("msgr/profile_picture.html")
+def profile_picture(profile, size, css_class, alt):
+    """Display a user's profile picture with the variants that fit
+    the size (in pixels), in WebP for browsers that support it.
+    """
+    variants = get_variants(profile, size)
+    return {
+        "src": get_profile_pic(profile, size),
+        "webp": variants.get("webp"),
+        "jpeg": variants.get("jpeg"),
+        "size": size,
+        "css_class": css_class,
+        "alt": alt,
+    }
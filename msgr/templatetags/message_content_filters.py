@@ -1,31 +1,23 @@
-
-import re
-
 from django import template
 from django.template.defaultfilters import stringfilter
 from django.urls import reverse
 from django.utils.html import conditional_escape
 from django.utils.safestring import mark_safe
 
-from accounts.models import Profile
+from msgr import fragments
+from msgr.mentions import MENTION_RE, resolve_mentions
 
 
 register = template.Library()
 
 
-def get_link(match):
-    """Form the HTML anchor tag to the users' profiles."""
-
-    identifier = match.group()
-    profile = Profile.objects.filter(identifier__iexact=identifier[1:])
-    if profile.count() == 1:
-        # If user exists
-        profile = profile.get()
-        url = reverse("msgr:profile", args=[profile.pk])
-    else:
-        url = ""
-    link = '<a href="%s">%s</a>' % (url, identifier)
-    return link
+@register.simple_tag
+def render_messages(message_list, user):
+    """Prepare the rendered html of all messages of a list at once,
+    each as the 'fragment' of the message.
+    """
+    fragments.render_messages(message_list, user)
+    return ""
 
 
 @register.filter(needs_autoescape=True)
@@ -37,5 +29,13 @@ def inline_id(text, autoescape=True):
 
     if autoescape:
         text = conditional_escape(text)
-    text = re.sub("@\w{5,}", get_link, text)
-    return mark_safe(text)
+    profile_pks = resolve_mentions([text])
+
+    def get_link(match):
+        """Form the HTML anchor tag to the users' profiles."""
+        identifier = match.group()
+        pk = profile_pks[match.group(1).lower()]
+        url = reverse("msgr:profile", args=[pk]) if pk else ""
+        return '<a href="%s">%s</a>' % (url, identifier)
+
+    return mark_safe(MENTION_RE.sub(get_link, text))
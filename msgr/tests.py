@@ -1,3 +1,936 @@
-from django.test import TestCase
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from . import fragments, writebehind
+from .membership import memberships
+from .mentions import profile_pks, resolve_mentions
+from .metrics import metrics
+from .middleware import (
+    LoginRequiredMiddleware,
+    MetricsMiddleware,
+    PrimaryPinMiddleware,
+)
+from .models import (
+    ArchivedMessage,
+    Chat,
+    Join,
+    Message,
+    last_active_updates,
+    lat_updates,
+)
+from .routers import ReplicaRouter, pinned_until, use_primary
+from .search import search_messages
+from .views import ChatMessagesView
+from accounts.models import User
+
+
+class LoginRequiredMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        self.middleware = LoginRequiredMiddleware(self.get_response)
+        self.factory = RequestFactory()
+
+    @staticmethod
+    def get_response(request):
+        return HttpResponse()
+
+    def get_request(self, path):
+        request = self.factory.get(path)
+        request.user = AnonymousUser()
+        return request
+
+    def test_restricted_prefixes(self):
+        self.assertEqual(self.middleware.restricted_prefixes, ("/m/",))
+
+    def test_anonymous_user_in_app(self):
+        response = self.middleware(self.get_request("/m/chats/1/"))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, "/login/?next=/m/chats/1/")
+
+    def test_anonymous_user_outside_app(self):
+        for path in ("/", "/login/", "/static/css/base.css", "/media/a.png"):
+            response = self.middleware(self.get_request(path))
+            self.assertEqual(response.status_code, 200)
+
+    def test_overhead(self):
+        """Micro-benchmark the time the middleware adds to each request,
+        compared to resolving the path of the request.
+        """
+        request = self.get_request("/login/")
+        number = 10000
+
+        def best_time(func):
+            return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+        overhead = (best_time(lambda: self.middleware(request))
+                    - best_time(lambda: self.get_response(request)))
+        resolving = best_time(lambda: resolve(request.path_info))
+        sys.stderr.write(
+            "\nLoginRequiredMiddleware: %.2f us per request "
+            "(resolving the path: %.2f us)\n"
+            % (overhead * 1e6, resolving * 1e6)
+        )
+        self.assertLess(overhead, resolving)
+
+
+class MetricsMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        self.middleware = MetricsMiddleware(self.get_response)
+        self.factory = RequestFactory()
+        metrics.clear()
+
+    def tearDown(self):
+        metrics.clear()
+
+    @staticmethod
+    def get_response(request):
+        return HttpResponse("hello")
+
+    def get_request(self, path):
+        request = self.factory.get(path)
+        # It's set by the handler when the path is resolved.
+        request.resolver_match = resolve(path)
+        return request
+
+    def test_render(self):
+        self.middleware.sample_rate = 1
+        self.middleware(self.get_request("/m/"))
+        text = metrics.render()
+        self.assertIn('msgr_requests_total{view="msgr:main"} 1', text)
+        self.assertIn('msgr_request_duration_seconds_bucket'
+                      '{view="msgr:main",le="+Inf"} 1', text)
+        self.assertIn('msgr_response_bytes_total{view="msgr:main"} 5', text)
+        self.assertIn('msgr_sampled_requests_total{view="msgr:main"} 1', text)
+
+    @override_settings(METRICS_SAMPLE_RATE=1, MIDDLEWARE=[
+        "msgr.middleware.MetricsMiddleware", *settings.MIDDLEWARE,
+    ])
+    def test_template_time(self):
+        self.client.get("/login/")
+        line = next(
+            line for line in metrics.render().splitlines()
+            if line.startswith("msgr_template_duration_seconds_total{")
+        )
+        self.assertGreater(float(line.split()[-1]), 0)
+
+    def test_overhead(self):
+        """Micro-benchmark the time the middleware adds to each request
+        (with the default sample rate), compared to a simple page.
+        """
+        request = self.get_request("/login/")
+        number = 10000
+
+        def best_time(func, number=number):
+            return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+        overhead = (best_time(lambda: self.middleware(request))
+                    - best_time(lambda: self.get_response(request)))
+        page = best_time(lambda: self.client.get("/login/"), number=50)
+        sys.stderr.write(
+            "\nMetricsMiddleware: %.2f us per request "
+            "(the login page: %.2f us)\n" % (overhead * 1e6, page * 1e6)
+        )
+        # It's meant to be around 1% of the page; the bound is generous
+        # so that timing noise doesn't fail it.
+        self.assertLess(overhead, page * 0.1)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        token = pinned_until.set(0.0)
+        self.addCleanup(pinned_until.reset, token)
+
+    def test_reads_from_replica(self):
+        self.assertEqual(self.router.db_for_read(Message), "replica")
+        self.assertEqual(self.router.db_for_read(Session), "default")
+
+    def test_reads_from_primary_after_write(self):
+        self.assertEqual(self.router.db_for_write(Message), "default")
+        self.assertEqual(self.router.db_for_read(Message), "default")
+
+    def test_use_primary(self):
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(Message), "default")
+        self.assertEqual(self.router.db_for_read(Message), "replica")
+
+    def test_no_replicas(self):
+        with self.settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.router.db_for_read(Message), "default")
+
+    def test_pin_cookie(self):
+        def write(request):
+            self.router.db_for_write(Message)
+            return HttpResponse()
+
+        def read(request):
+            return HttpResponse(self.router.db_for_read(Message))
+
+        factory = RequestFactory()
+        response = PrimaryPinMiddleware(write)(factory.get("/"))
+        cookie = response.cookies[PrimaryPinMiddleware.COOKIE_NAME]
+        request = factory.get("/")
+        response = PrimaryPinMiddleware(read)(request)
+        self.assertEqual(response.content, b"replica")
+        request.COOKIES[PrimaryPinMiddleware.COOKIE_NAME] = cookie.value
+        response = PrimaryPinMiddleware(read)(request)
+        self.assertEqual(response.content, b"default")
+
+
+# A replica set up for the tests like in the README, i.e. mirroring
+# the default database.
+HAS_REPLICA = settings.DATABASES.get("replica", {}).get(
+    "TEST", {}
+).get("MIRROR") == "default"
+
+
+@skipUnless(HAS_REPLICA, "Needs a 'replica' database mirroring 'default'.")
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaTests(TransactionTestCase):
+    # Reads in transactions go to the primary, so unlike TestCase,
+    # the test doesn't run in one.
+    databases = {"default", "replica"} if HAS_REPLICA else {"default"}
+
+    def setUp(self):
+        patcher = mock.patch.object(writebehind.flusher, "start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(writebehind.flush_all)
+        token = pinned_until.set(0.0)
+        self.addCleanup(pinned_until.reset, token)
+
+    def test_read_your_writes(self):
+        user = User.objects.create_user("user@example.com", "password")
+        chat, _ = Chat.objects.get_or_create_private(user, user)
+        self.client.force_login(user)
+        pinned_until.set(0.0)
+        self.assertEqual(Message.objects.all().db, "replica")
+
+        response = self.client.post(reverse("msgr:chat", args=[chat.pk]),
+                                    {"content": "hello"})
+        self.assertEqual(response.status_code, 204)
+        # The sender reads from the primary for a while.
+        response = self.client.get(reverse("msgr:messages", args=[chat.pk]))
+        self.assertContains(response, "hello")
+        self.assertIn(PrimaryPinMiddleware.COOKIE_NAME, self.client.cookies)
+
+
+@override_settings(PASSWORD_HASHERS=[
+    "django.contrib.auth.hashers.MD5PasswordHasher",
+])
+class MentionCacheTests(TestCase):
+
+    def setUp(self):
+        profile_pks.clear()
+        self.addCleanup(profile_pks.clear)
+        self.user = User.objects.create_user("a@example.com", "password")
+        self.profile = self.user.profile
+        self.profile.identifier = "alice"
+        self.profile.save()
+
+    def test_forget_changed_id(self):
+        pk = self.profile.pk
+        self.assertEqual(resolve_mentions(["@alice @bobby"]),
+                         {"alice": pk, "bobby": None})
+        self.profile.identifier = "Bobby"
+        self.profile.save()
+        self.assertEqual(resolve_mentions(["@alice @bobby"]),
+                         {"alice": None, "bobby": pk})
+        # The same instance is compared with what it was last saved with.
+        self.profile.identifier = "alice"
+        self.profile.save()
+        self.assertEqual(resolve_mentions(["@alice @bobby"]),
+                         {"alice": pk, "bobby": None})
+
+    def test_keep_unchanged_id(self):
+        resolve_mentions(["@alice"])
+        user = User.objects.get(pk=self.user.pk)
+        with mock.patch.object(profile_pks, "discard_value") as discard_value:
+            # Saving a user saves their profile, e.g. when they log in.
+            user.save()
+            user.profile.first_name = "alice"
+            user.profile.save()
+        discard_value.assert_not_called()
+        self.assertEqual(profile_pks.get("alice"), self.profile.pk)
+
+
+class WriteBehindTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(writebehind.flusher, "start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(writebehind.flush_all)
+        self.time = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        self.chats = [Chat.objects.create(lat=self.time) for _ in range(3)]
+
+    def get_lats(self):
+        return [Chat.objects.get(pk=chat.pk).lat for chat in self.chats]
+
+    def test_flush_greatest(self):
+        minutes = [(0, 3), (0, 1), (1, -5), (0, 2), (1, -1), (2, 4)]
+        for i, m in minutes:
+            lat_updates.add(self.chats[i].pk,
+                            self.time + timedelta(minutes=m))
+        user = User.objects.create_user("a@example.com", "password")
+        self.chats[0].participants.add(user)
+        join = Join.objects.get(chat=self.chats[0], user=user)
+        for m in (2, 7, 5):
+            last_active_updates.add(join.pk, join.last_active
+                                    + timedelta(minutes=m))
+        # It's written in several batches.
+        with mock.patch.object(writebehind, "BATCH_SIZE", 2):
+            writebehind.flush_all()
+
+        # Each row gets the greatest of its values and the one it had.
+        self.assertEqual(self.get_lats(), [
+            self.time + timedelta(minutes=3),
+            self.time,
+            self.time + timedelta(minutes=4),
+        ])
+        self.assertEqual(Join.objects.get(pk=join.pk).last_active,
+                         join.last_active + timedelta(minutes=7))
+        self.assertEqual(lat_updates._pending, {})
+
+    def test_failed_flush(self):
+        lat_updates.add(self.chats[0].pk, self.time + timedelta(minutes=1))
+        with mock.patch.object(lat_updates, "write",
+                               side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                lat_updates.flush()
+        # The values are kept for the next flush.
+        lat_updates.add(self.chats[0].pk, self.time)
+        lat_updates.flush()
+        self.assertEqual(self.get_lats()[0],
+                         self.time + timedelta(minutes=1))
+
+
+class UnreadCountTests(TestCase):
+    """Check the unread messages counters, which are kept up to date as
+    messages are sent, read and deleted, against their recount.
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(writebehind.flusher, "start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(writebehind.flush_all)
+        self.addCleanup(memberships.clear)
+        self.users = [User.objects.create_user("%s@example.com" % name,
+                                               "password")
+                      for name in ("a", "b", "c")]
+        self.chat = Chat.objects.create()
+        self.chat.participants.set(self.users)
+
+    def assertUnreadCounts(self, *counts):
+        """Check the counters of the users, and that they're the same as
+        the unread_counts command counts.
+        """
+        writebehind.flush_all()
+        self.assertEqual([
+            Join.objects.get(chat=self.chat, user=user).unread_count
+            for user in self.users
+        ], list(counts))
+        call_command("unread_counts", "--check", stdout=StringIO())
+
+    def send(self, user, content):
+        self.client.force_login(user)
+        response = self.client.post(reverse("msgr:chat",
+                                            args=[self.chat.pk]),
+                                    {"content": content})
+        self.assertEqual(response.status_code, 204)
+
+    def test_unread_counts(self):
+        a, b, c = self.users
+        for i in range(3):
+            self.send(b, "hello %s" % i)
+        self.assertUnreadCounts(3, 0, 3)
+
+        self.client.force_login(a)
+        response = self.client.post(
+            reverse("msgr:send_messages", args=[self.chat.pk]),
+            {"messages": [{"content": "hi"}, {"content": "there"}]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertUnreadCounts(3, 2, 5)
+
+        # Reading the latest messages reads all of them.
+        self.client.get(reverse("msgr:messages_data", args=[self.chat.pk]))
+        self.assertUnreadCounts(0, 2, 5)
+
+        # Reading only older messages leaves the newer ones unread.
+        pks = list(self.chat.messages.order_by("pk")
+                   .values_list("pk", flat=True))
+        self.client.force_login(c)
+        self.client.get(reverse("msgr:messages_data", args=[self.chat.pk]),
+                        {"before_pk": pks[2]})
+        self.assertUnreadCounts(0, 2, 3)
+
+        # Deleting a message stops counting it for those who haven't
+        # read it.
+        self.client.force_login(b)
+        self.client.post(reverse("msgr:delete_message"),
+                         {"message": pks[2]})
+        self.assertUnreadCounts(0, 2, 2)
+        self.client.force_login(a)
+        self.client.post(reverse("msgr:delete_message"),
+                         {"message": pks[4]})
+        self.assertUnreadCounts(0, 1, 1)
+
+        # Leaving the chat page reads all of them.
+        self.client.force_login(c)
+        self.client.post(reverse("msgr:chat", args=[self.chat.pk]))
+        self.assertUnreadCounts(0, 1, 0)
+        self.send(a, "bye")
+        self.assertUnreadCounts(0, 2, 1)
+
+
+@override_settings(PASSWORD_HASHERS=[
+    "django.contrib.auth.hashers.MD5PasswordHasher",
+])
+class SendMessagesTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(writebehind.flusher, "start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(writebehind.flush_all)
+        self.addCleanup(memberships.clear)
+        self.a = User.objects.create_user("a@example.com", "password")
+        self.b = User.objects.create_user("b@example.com", "password")
+        self.chat, _ = Chat.objects.get_or_create_private(self.a, self.b)
+        self.client.force_login(self.a)
+
+    def send(self, data):
+        return self.client.post(
+            reverse("msgr:send_messages", args=[self.chat.pk]),
+            data, content_type="application/json",
+        )
+
+    def get_unread_counts(self):
+        return dict(Join.objects.filter(chat=self.chat).values_list(
+            "user", "unread_count"
+        ))
+
+    def test_send(self):
+        response = self.send({"messages": [{"content": "hello %s" % i}
+                                           for i in range(3)]})
+        self.assertEqual(response.status_code, 201)
+        pks = response.json()["pks"]
+        self.assertEqual(
+            list(self.chat.messages.order_by("pk").values_list("pk",
+                                                               "content")),
+            [(pk, "hello %s" % i) for i, pk in enumerate(pks)],
+        )
+        self.assertEqual(self.get_unread_counts(),
+                         {self.a.pk: 0, self.b.pk: 3})
+        response = self.send({"messages": [{"content": "bye"}]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_unread_counts(),
+                         {self.a.pk: 0, self.b.pk: 4})
+        # They're found by search too.
+        self.assertEqual(len(search_messages("hello", self.a)), 3)
+
+    def test_invalid_items(self):
+        response = self.send({"messages": [
+            {"content": "hello"}, {"content": ""}, "hi", {},
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sorted(response.json()["errors"]), ["1", "2", "3"])
+        self.assertIn("content", response.json()["errors"]["1"])
+        # None of them are sent.
+        self.assertFalse(self.chat.messages.exists())
+        self.assertEqual(self.get_unread_counts(),
+                         {self.a.pk: 0, self.b.pk: 0})
+
+    def test_invalid_body(self):
+        for data in ("not json", {"content": "hello"}, {"messages": []},
+                     {"messages": "hello"}):
+            response = self.send(data)
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.chat.messages.exists())
+
+    def test_too_many(self):
+        messages = [{"content": "hello"}] * 501
+        response = self.send({"messages": messages})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "at most 500 messages"})
+        self.assertFalse(self.chat.messages.exists())
+        response = self.send({"messages": messages[:500]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_unread_counts()[self.b.pk], 500)
+
+    def test_not_member(self):
+        stranger = User.objects.create_user("c@example.com", "password")
+        self.client.force_login(stranger)
+        response = self.send({"messages": [{"content": "hello"}]})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(self.chat.messages.exists())
+
+
+class SeenMessagesTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(writebehind.flusher, "start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(writebehind.flush_all)
+        self.addCleanup(memberships.clear)
+        self.a = User.objects.create_user("a@example.com", "password")
+        self.b = User.objects.create_user("b@example.com", "password")
+        self.chat, _ = Chat.objects.get_or_create_private(self.a, self.b)
+
+    def get_updates(self, user, latest_pk, latest_seen_pk):
+        self.client.force_login(user)
+        return self.client.get(
+            reverse("msgr:updates_data", args=[self.chat.pk]),
+            {"latest_pk": latest_pk, "latest_seen_pk": latest_seen_pk},
+        ).json()
+
+    def test_seen_by_fetching_updates(self):
+        messages = [Message.objects.create(chat=self.chat, sender=self.a,
+                                           content="hello %s" % i)
+                    for i in range(2)]
+        updates = self.get_updates(self.a, messages[-1].pk, 0)
+        self.assertEqual(updates["seen_messages_pk"], [])
+        self.assertEqual(int(updates["latest_seen_pk"]), 0)
+
+        # B gets the messages, so they're seen by B.
+        updates = self.get_updates(self.b, 0, 0)
+        self.assertEqual([m[0] for m in updates["messages"]],
+                         [m.pk for m in reversed(messages)])
+        updates = self.get_updates(self.a, messages[-1].pk, 0)
+        self.assertEqual(updates["seen_messages_pk"],
+                         [m.pk for m in messages])
+        self.assertEqual(updates["latest_seen_pk"], messages[-1].pk)
+        self.assertEqual(self.chat.get_read_pk(self.a), messages[-1].pk)
+
+        # The ticks of the messages show it too.
+        self.client.force_login(self.a)
+        data = self.client.get(reverse("msgr:messages_data",
+                                       args=[self.chat.pk])).json()
+        self.assertEqual([m[4] for m in data["messages"]], [True, True])
+
+
+# Pages are smaller than usual, so that some of them are partly archived.
+@mock.patch.object(ChatMessagesView, "paginate_by", 6)
+class ArchivedMessagesTests(TestCase):
+    """Check paging through a chat whose older half is archived."""
+
+    def setUp(self):
+        self.addCleanup(memberships.clear)
+        user = User.objects.create_user("a@example.com", "password")
+        self.chat, _ = Chat.objects.get_or_create_private(user, user)
+        now = datetime.now(timezone.utc)
+        for i in range(21):
+            # The first 10 are more than a year old.
+            send_time = now - timedelta(days=400 if i < 10 else 1,
+                                        minutes=-i)
+            Message.objects.create(chat=self.chat, sender=user,
+                                   content="message %s" % i,
+                                   send_time=send_time)
+        self.pks = list(Message.objects.order_by("pk")
+                        .values_list("pk", flat=True))
+        call_command("archive_messages", stdout=StringIO())
+        self.client.force_login(user)
+
+    def get_page(self, **cursor):
+        data = self.client.get(reverse("msgr:messages_data",
+                                       args=[self.chat.pk]), cursor).json()
+        return [m[0] for m in data["messages"]], data
+
+    def test_archived(self):
+        self.assertEqual(
+            list(ArchivedMessage.objects.order_by("pk")
+                 .values_list("pk", flat=True)),
+            self.pks[:10],
+        )
+        self.assertEqual(list(self.chat.messages.order_by("pk")
+                              .values_list("pk", flat=True)), self.pks[10:])
+
+    def test_older_pages(self):
+        pks, data = self.get_page()
+        seen = pks
+        while data["has_more"]:
+            pks, data = self.get_page(before_pk=data["last_item_pk"])
+            seen += pks
+        self.assertEqual(seen, self.pks[::-1])
+
+    def test_newer_pages(self):
+        pks, data = self.get_page(after_pk=0)
+        seen = pks[::-1]
+        self.assertFalse(data["has_more"])
+        while data["has_newer"]:
+            pks, data = self.get_page(after_pk=data["first_item_pk"])
+            self.assertTrue(data["has_more"])
+            seen += pks[::-1]
+        self.assertEqual(seen, self.pks)
+
+    def test_around_pages(self):
+        for i in (7, 9, 10, 12):
+            pks, data = self.get_page(around_pk=self.pks[i])
+            self.assertEqual(pks, self.pks[i - 2:i + 4][::-1])
+            self.assertTrue(data["has_more"])
+            self.assertTrue(data["has_newer"])
+        pks, data = self.get_page(around_pk=self.pks[0])
+        self.assertEqual(pks, self.pks[:4][::-1])
+        self.assertFalse(data["has_more"])
+
+
+class MigrationTestCase(TransactionTestCase):
+    """Migrate the app back to migrate_from before each test, and
+    forward to its latest migration after it.
+    """
+
+    app_label = "msgr"
+    migrate_from = None
+
+    def setUp(self):
+        self.addCleanup(self.migrate, None)
+        self.apps = self.migrate(self.migrate_from)
+
+    def migrate(self, name):
+        """Migrate the app to a migration (or its latest one if None),
+        and return the models as of then.
+        """
+        executor = MigrationExecutor(connection)
+        if name is None:
+            targets = executor.loader.graph.leaf_nodes()
+        else:
+            targets = [(self.app_label, name)]
+        executor.migrate(targets)
+        executor.loader.build_graph()
+        return executor.loader.project_state(targets).apps
+
+
+class LastReadMessageMigrationTests(MigrationTestCase):
+    migrate_from = "0005_message_join_indexes"
+
+    def test_backfill(self):
+        User = self.apps.get_model("accounts", "User")
+        Chat = self.apps.get_model("msgr", "Chat")
+        Join = self.apps.get_model("msgr", "Join")
+        Message = self.apps.get_model("msgr", "Message")
+        a = User.objects.create(email="a@example.com")
+        b = User.objects.create(email="b@example.com")
+        chat = Chat.objects.create()
+        for user in (a, b):
+            Join.objects.create(chat=chat, user=user)
+        messages = [
+            Message.objects.create(chat=chat, sender=sender, content="hi",
+                                   is_seen=is_seen)
+            for sender, is_seen in [(a, True), (b, True), (a, True),
+                                    (b, False), (a, False)]
+        ]
+
+        # Users have read up to the latest message others have seen.
+        apps = self.migrate("0006_join_last_read_message")
+        Join = apps.get_model("msgr", "Join")
+        self.assertEqual(
+            dict(Join.objects.values_list("user", "last_read_message_id")),
+            {a.pk: messages[1].pk, b.pk: messages[2].pk},
+        )
+
+        # And back, messages are seen up to where others have read.
+        apps = self.migrate(self.migrate_from)
+        Message = apps.get_model("msgr", "Message")
+        self.assertEqual(
+            list(Message.objects.order_by("pk").values_list("is_seen",
+                                                            flat=True)),
+            [True, True, True, False, False],
+        )
+
+
+class PrivateChatTests(TestCase):
+
+    def test_get_or_create_private(self):
+        a = User.objects.create_user("a@example.com", "password")
+        b = User.objects.create_user("b@example.com", "password")
+        chat, created = Chat.objects.get_or_create_private(a, b)
+        self.assertTrue(created)
+        self.assertEqual(Chat.objects.get_or_create_private(b, a),
+                         (chat, False))
+        self.assertEqual(Chat.objects.get_or_create_private(a, b),
+                         (chat, False))
+        self.assertEqual(set(chat.participants.all()), {a, b})
+
+        saved, created = Chat.objects.get_or_create_private(a, a)
+        self.assertTrue(created)
+        self.assertNotEqual(saved, chat)
+        self.assertEqual(list(saved.participants.all()), [a])
+
+
+class PrivatePairMigrationTests(MigrationTestCase):
+    migrate_from = "0007_message_search_index"
+
+    def test_merge_duplicates(self):
+        User = self.apps.get_model("accounts", "User")
+        Chat = self.apps.get_model("msgr", "Chat")
+        Join = self.apps.get_model("msgr", "Join")
+        Message = self.apps.get_model("msgr", "Message")
+        a, b, c = [User.objects.create(email="%s@example.com" % name)
+                   for name in "abc"]
+
+        def make_chat(users, senders):
+            chat = Chat.objects.create()
+            for user in users:
+                Join.objects.create(chat=chat, user=user)
+            for sender in senders:
+                Message.objects.create(chat=chat, sender=sender,
+                                       content="hi")
+            return chat
+
+        ab = make_chat([a, b], [a, b])
+        group = make_chat([a, b, c], [c])
+        ab_duplicate = make_chat([b, a], [b, b])
+        aa = make_chat([a], [a])
+        aa_duplicate = make_chat([a], [a])
+        # Nobody has been in the chats since the messages were sent,
+        # but A has read the duplicate one.
+        Join.objects.update(last_active=datetime(2022, 1, 1,
+                                                 tzinfo=timezone.utc))
+        Join.objects.filter(chat=ab_duplicate, user=a).update(
+            last_read_message_id=Message.objects.filter(
+                chat=ab_duplicate
+            ).latest("pk").pk
+        )
+
+        apps = self.migrate("0008_chat_private_pair")
+        Chat = apps.get_model("msgr", "Chat")
+        Join = apps.get_model("msgr", "Join")
+        Message = apps.get_model("msgr", "Message")
+        self.assertEqual(
+            {chat.pk: (chat.low_user_id, chat.high_user_id)
+             for chat in Chat.objects.all()},
+            {ab.pk: (a.pk, b.pk), group.pk: (None, None),
+             aa.pk: (a.pk, a.pk)},
+        )
+        self.assertEqual(Message.objects.filter(chat=ab.pk).count(), 4)
+        self.assertEqual(Message.objects.filter(chat=group.pk).count(), 1)
+        self.assertEqual(Message.objects.filter(chat=aa.pk).count(), 2)
+        self.assertEqual(Join.objects.filter(chat=ab.pk).count(), 2)
+        self.assertEqual(Join.objects.filter(chat=aa.pk).count(), 1)
+        self.assertEqual(Join.objects.filter(chat=group.pk).count(), 3)
+        # Joins keep the latest of what was read, and the rest is unread.
+        join = Join.objects.get(chat=ab.pk, user=a.pk)
+        self.assertEqual(
+            join.last_read_message_id,
+            Message.objects.filter(chat=ab.pk).latest("pk").pk,
+        )
+        self.assertEqual(join.unread_count, 0)
+        self.assertEqual(Join.objects.get(chat=ab.pk, user=b.pk).unread_count, 1)
+
+
+# Hashing passwords is slow on purpose, and the tests make many users.
+@override_settings(PASSWORD_HASHERS=[
+    "django.contrib.auth.hashers.MD5PasswordHasher",
+])
+class QueryBudgetTests(TestCase):
+    """Check that the views make as many queries for many rows as for a
+    few (i.e. that they don't make a query per row), and that their
+    responses don't get too large.
+    """
+
+    # Numbers of chats, messages and users in the fixtures.
+    SIZES = (2, 6, 18)
+
+    def setUp(self):
+        # Buffered writes are flushed by the tests, instead of a thread.
+        patcher = mock.patch.object(writebehind.flusher, "start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(writebehind.flush_all)
+
+    @staticmethod
+    def clear_caches():
+        caches[fragments.CACHE_ALIAS].clear()
+        profile_pks.clear()
+        memberships.clear()
+
+    @staticmethod
+    def make_user(identifier):
+        user = User.objects.create_user("%s@example.com" % identifier,
+                                        "password")
+        user.profile.first_name = identifier
+        user.profile.identifier = identifier
+        user.profile.save()
+        return user
+
+    def make_fixture(self, size):
+        """Make a user with size chats and size messages in the first
+        one, and log them in; and a stranger they have no chat with.
+        """
+        user = self.make_user("user%sx" % size)
+        stranger = self.make_user("stranger%sx" % size)
+        others = [self.make_user("friend%sx%s" % (size, i))
+                  for i in range(size)]
+        chats = [Chat.objects.get_or_create_private(user, other)[0]
+                 for other in others]
+        chat = chats[0]
+        messages = [
+            Message.objects.create(
+                chat=chat, sender=(user, others[0])[i % 2],
+                content="hi @friend%sx%s and @nobody%s" % (size, i, i),
+            )
+            for i in range(size)
+        ]
+        chat.mark_read(others[0], messages[-1].pk)
+        writebehind.flush_all()
+        self.client.force_login(user)
+        return {"size": size, "user": user, "stranger": stranger,
+                "others": others, "chat": chat, "messages": messages}
+
+    def assertQueryBudget(self, get_response, max_bytes):
+        """Check that get_response(fixture) makes the same number of
+        queries for fixtures of each size, and that its responses are
+        at most max_bytes long; return the responses.
+        """
+        results = []
+        for size in self.SIZES:
+            fixture = self.make_fixture(size)
+            self.clear_caches()
+            with CaptureQueriesContext(connection) as queries:
+                response = get_response(fixture)
+            results.append((size, queries, response))
+            self.assertLess(response.status_code, 400)
+            self.assertLessEqual(
+                len(response.content), max_bytes,
+                "The response for %s rows is %s bytes." % (
+                    size, len(response.content)
+                ),
+            )
+
+        first_size, first_queries, _ = results[0]
+        for size, queries, _ in results[1:]:
+            if len(queries) != len(first_queries):
+                self.fail(
+                    "%s queries for %s rows, but %s for %s rows:\n%s" % (
+                        len(first_queries), first_size, len(queries), size,
+                        "\n".join(
+                            "%s. %s" % (i, query["sql"])
+                            for i, query in enumerate(queries, 1)
+                        ),
+                    )
+                )
+        return [response for _, _, response in results]
+
+    def test_chats_list(self):
+        responses = self.assertQueryBudget(
+            lambda f: self.client.get(reverse("msgr:main")),
+            max_bytes=12000,
+        )
+        self.assertContains(responses[-1], "friend18x17")
+
+    def test_chat(self):
+        self.assertQueryBudget(
+            lambda f: self.client.get(reverse("msgr:chat",
+                                              args=[f["chat"].pk])),
+            max_bytes=5000,
+        )
+
+    def test_chat_messages(self):
+        responses = self.assertQueryBudget(
+            lambda f: self.client.get(reverse("msgr:messages",
+                                              args=[f["chat"].pk])),
+            max_bytes=10000,
+        )
+        self.assertContains(responses[-1], "@nobody17")
+
+    def test_chat_updates(self):
+        responses = self.assertQueryBudget(
+            lambda f: self.client.get(
+                reverse("msgr:updates", args=[f["chat"].pk]),
+                {"latest_pk": 0, "latest_seen_pk": 0},
+            ),
+            max_bytes=10000,
+        )
+        self.assertContains(responses[-1], "@nobody17")
+
+    def test_chat_messages_data(self):
+        responses = self.assertQueryBudget(
+            lambda f: self.client.get(reverse("msgr:messages_data",
+                                              args=[f["chat"].pk])),
+            max_bytes=10000,
+        )
+        self.assertContains(responses[-1], "@nobody17")
+        # The IDs each message mentions, for the client to link.
+        self.assertEqual(responses[-1].json()["messages"][0][5],
+                         ["friend18x17", "nobody17"])
+
+    def test_chat_updates_data(self):
+        responses = self.assertQueryBudget(
+            lambda f: self.client.get(
+                reverse("msgr:updates_data", args=[f["chat"].pk]),
+                {"latest_pk": 0, "latest_seen_pk": 0},
+            ),
+            max_bytes=10000,
+        )
+        self.assertContains(responses[-1], "@nobody17")
+
+    def test_send_message(self):
+        self.assertQueryBudget(
+            lambda f: self.client.post(reverse("msgr:chat",
+                                               args=[f["chat"].pk]),
+                                       {"content": "hello"}),
+            max_bytes=0,
+        )
+
+    def test_send_messages(self):
+        responses = self.assertQueryBudget(
+            lambda f: self.client.post(
+                reverse("msgr:send_messages", args=[f["chat"].pk]),
+                {"messages": [{"content": "hello %s" % i}
+                              for i in range(f["size"])]},
+                content_type="application/json",
+            ),
+            max_bytes=1000,
+        )
+        self.assertEqual(len(responses[-1].json()["pks"]), 18)
+
+    def test_leave_chat(self):
+        self.assertQueryBudget(
+            lambda f: self.client.post(reverse("msgr:chat",
+                                               args=[f["chat"].pk])),
+            max_bytes=0,
+        )
+
+    def test_search(self):
+        responses = self.assertQueryBudget(
+            lambda f: self.client.get(reverse("msgr:search"),
+                                      {"q": "friend%sx" % f["size"]}),
+            max_bytes=8000,
+        )
+        self.assertContains(responses[-1], "friend18x17")
+
+    def test_start_chat(self):
+        self.assertQueryBudget(
+            lambda f: self.client.post(reverse(
+                "msgr:profile", args=[f["stranger"].profile.pk]
+            )),
+            max_bytes=0,
+        )
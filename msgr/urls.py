@@ -17,6 +17,9 @@ urlpatterns = [
     path("users/<int:pk>/",
          views.ProfilePageView.as_view(),
          name="profile"),
+    path("messages/",
+         views.MessageSearchView.as_view(),
+         name="message_search"),
     path("chats/",
          RedirectView.as_view(pattern_name="msgr:main", permanent=True),
          name="chats"),
@@ -29,7 +32,19 @@ urlpatterns = [
     path("chats/<int:pk>/updates/",
          views.ChatUpdatesView.as_view(),
          name="updates"),
+    path("api/v1/chats/<int:pk>/messages/",
+         views.ChatMessagesDataView.as_view(),
+         name="messages_data"),
+    path("api/v1/chats/<int:pk>/messages/send/",
+         views.ChatSendMessagesView.as_view(),
+         name="send_messages"),
+    path("api/v1/chats/<int:pk>/updates/",
+         views.ChatUpdatesDataView.as_view(),
+         name="updates_data"),
     path("chats/delmessage/",
         views.ChatDeleteMessageView.as_view(),
         name="delete_message"),
+    path("metrics/",
+         views.MetricsView.as_view(),
+         name="metrics"),
 ]
@@ -1,7 +1,18 @@
 
+import asyncio
+import json
+from contextlib import nullcontext
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.db.models import Q, Count, CharField, Value as V
-from django.db.models.functions import Concat
+from django.db import transaction
+from django.db.models import (
+    F,
+    BigIntegerField,
+    OuterRef,
+    Subquery,
+)
+from django.db.models.functions import Coalesce
 from django.http import (
     Http404,
     HttpResponse,
@@ -16,11 +27,27 @@ from django.views.generic import (
     ListView,
     View,
 )
-from django.views.generic.list import MultipleObjectMixin
 
-from .forms import SearchForm, MessageForm
-from .models import Chat, Message
+from . import fragments
+from .forms import SearchForm, MessageForm, MessageSearchForm
+from .hub import hub
+from .membership import is_member
+from .metrics import metrics, timing_templates
+from .models import Chat, Join, Message
+from .routers import use_primary
+from .search import index_messages, search_messages
+from .serializers import serialize_messages
 from accounts.models import Profile
+from accounts.search import search_profiles
+
+
+def mark_seen(chat, user, message_pk):
+    """Mark messages of a chat up to the given one as seen by the user,
+    and let the subscribers of the chat know about it.
+    """
+    if chat.mark_read(user, message_pk):
+        hub.publish(chat.pk, {"type": "seen", "user": user.pk,
+                              "pk": message_pk})
 
 
 class SearchFormMixin:
@@ -35,31 +62,87 @@ class ChatsListView(SearchFormMixin, ListView):
     """Main page list of a user's chat entries."""
 
     template_name = "msgr/chats_list.html"
+    paginate_by = 30
 
     def get_queryset(self):
-        return self.request.user.joins.order_by("-chat__lat")
+        # The user whose profile represents the chat is the other
+        # participant, or the user themselves in "saved messages".
+        other_joins = Join.objects.filter(
+            chat=OuterRef("chat")
+        ).exclude(user=OuterRef("user"))
+        return self.request.user.joins.annotate(
+            lat=F("chat__lat"),
+            profile_user_id=Coalesce(
+                Subquery(other_joins.values("user")[:1]), F("user"),
+                output_field=BigIntegerField(),
+            ),
+        ).order_by("-lat")
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Get profiles of all chats on the page at once.
+        joins = context["object_list"]
+        profiles = Profile.objects.filter(
+            user__in=[join.profile_user_id for join in joins]
+        )
+        profiles = {profile.user_id: profile for profile in profiles}
+        for join in joins:
+            join.profile = profiles[join.profile_user_id]
+        return context
 
 
 class SearchView(SearchFormMixin, ListView):
     """Result page of searching for users."""
 
     template_name = "msgr/search_page.html"
+    paginate_by = 20
 
     def get_queryset(self):
         query = self.request.GET.get("q")
         if query:
-            # Search in full name or id.
-            queryset = Profile.objects.annotate(
-                full_name=Concat(
-                    "first_name", V(" "), "last_name",
-                    output_field=CharField()
-                )
-            )
-            return queryset.filter(
-                Q(full_name__icontains=query) | Q(identifier__icontains=query)
-            )
+            # Primary keys of the profiles similar in full name or id,
+            # the most similar ones first.
+            return search_profiles(query)
         else:
-            return Profile.objects.none()
+            return []
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Only get the profiles of the current page.
+        profiles = Profile.objects.in_bulk(context["object_list"])
+        context["profile_list"] = [profiles[pk]
+                                   for pk in context["object_list"]
+                                   if pk in profiles]
+        return context
+
+
+class MessageSearchView(ListView):
+    """Result page of searching for messages in a user's chats."""
+
+    template_name = "msgr/message_search.html"
+    paginate_by = 20
+
+    def get_queryset(self):
+        self.form = MessageSearchForm(self.request.GET)
+        if not self.form.is_valid():
+            return Message.objects.none()
+        return search_messages(
+            self.form.cleaned_data["q"], self.request.user,
+            chat=self.form.cleaned_data["chat"],
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Get profiles of the senders on the page at once.
+        message_list = context["object_list"]
+        profiles = Profile.objects.filter(
+            user__in={m.sender_id for m in message_list}
+        )
+        profiles = {profile.user_id: profile for profile in profiles}
+        for m in message_list:
+            m.profile = profiles.get(m.sender_id)
+        context["search_form"] = self.form
+        return context
 
 
 class ProfilePageView(DetailView):
@@ -72,28 +155,10 @@ class ProfilePageView(DetailView):
 
     def post(self, request, *args, **kwargs):
         """Start and enter a chat between two users."""
-        # Get all chats in which the logged-in user participates.
-        chats = Chat.objects.annotate(Count("participants", distinct=True))
-        chats = chats.filter(participants=request.user)
-        other = self.get_object().user
-
-        if request.user == other:
-            # If this is the user's own profile,
-            # find the "saved messages" chat.
-            chats = chats.filter(participants__count=1)
-        else:
-            # Otherwise find the chat between
-            # the two users, if there is one.
-            chats = chats.filter(participants=other)
-
-        if chats:
-            # If a chat already exists, use that one to redirect to.
-            chat = chats.get()
-        else:
-            # Otherwise create a private chat between
-            # the logged-in user and the other user.
-            chat = Chat.objects.create()
-            chat.participants.set([request.user, other])
+        # Either the private chat between the logged-in user and the
+        # other user, or, on one's own profile, the "saved messages" chat.
+        chat, _ = Chat.objects.get_or_create_private(request.user,
+                                                     self.get_object().user)
 
         return HttpResponseRedirect(reverse("msgr:chat", args=[chat.pk]))
 
@@ -104,13 +169,20 @@ class UserInChatTestMixin(UserPassesTestMixin):
     """
 
     permission_denied_message = "Sorry, you can't access this chat."
+    # Views that only need the primary key of the chat can skip loading
+    # it; their object is then a Chat with nothing but its primary key.
+    load_chat = True
 
     def get_object(self, queryset=None):
+        if not self.load_chat:
+            return Chat(pk=self.kwargs["pk"])
         return get_object_or_404(Chat, pk=self.kwargs["pk"])
 
     def test_func(self):
+        if not is_member(self.request.user.pk, self.kwargs["pk"]):
+            return False
         self.object = self.get_object()
-        return self.object.participants.filter(pk=self.request.user.pk).exists()
+        return True
 
 
 class ChatView(UserInChatTestMixin, DetailView):
@@ -118,6 +190,7 @@ class ChatView(UserInChatTestMixin, DetailView):
 
     template_name = "msgr/chat_page.html"
     form_class = MessageForm
+    load_chat = False
 
     def post(self, request, *args, **kwargs):
         """Save a new message and record user's activity."""
@@ -131,6 +204,9 @@ class ChatView(UserInChatTestMixin, DetailView):
                 message.save()
                 # A new activity has happened in the chat, so:
                 self.object.update_lat()
+                self.object.add_unread(message)
+                hub.publish(self.object.pk, {"type": "messages",
+                                             "messages": [message]})
                 return HttpResponse(status=204)
             else:
                 return HttpResponse("message wasn't sent",
@@ -146,58 +222,261 @@ class ChatView(UserInChatTestMixin, DetailView):
     def get_context_data(self, **kwargs):
         if "form" not in kwargs:
             kwargs["form"] = self.form_class()
+        # A message to jump to, e.g. from search results.
+        around = self.request.GET.get("around", "")
+        kwargs["around_pk"] = int(around) if around.isdigit() else None
         return super().get_context_data(**kwargs)
 
 
-class ChatMessagesView(UserInChatTestMixin, MultipleObjectMixin, View):
-    """Paginate messages and return rendered result in json."""
+class ChatSendMessagesView(UserInChatTestMixin, View):
+    """Send a batch of messages to a chat at once.
+
+    The request body is json like {"messages": [{"content": "..."}]}.
+    Either all of the messages are sent, or none if any is invalid.
+    """
+
+    form_class = MessageForm
+    load_chat = False
+    max_messages = 500
+
+    def post(self, request, *args, **kwargs):
+        try:
+            items = json.loads(request.body)["messages"]
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({"error": "invalid json"}, status=400)
+        if not isinstance(items, list) or not items:
+            return JsonResponse({"error": "no messages"}, status=400)
+        if len(items) > self.max_messages:
+            return JsonResponse({
+                "error": "at most %s messages" % self.max_messages,
+            }, status=400)
+
+        messages = []
+        errors = {}
+        for i, item in enumerate(items):
+            form = self.form_class(item if isinstance(item, dict) else {})
+            if form.is_valid():
+                message = form.save(commit=False)
+                message.chat = self.object
+                message.sender = request.user
+                messages.append(message)
+            else:
+                errors[i] = form.errors
+        if errors:
+            return JsonResponse({"errors": errors}, status=400)
+
+        with transaction.atomic():
+            messages = Message.objects.bulk_create(messages)
+            # Bulk creation skips the signal that indexes them for search.
+            index_messages(messages)
+            self.object.add_unread(messages[0], count=len(messages))
+        self.object.update_lat()
+        hub.publish(self.object.pk, {"type": "messages",
+                                     "messages": messages})
+        return JsonResponse({"pks": [message.pk for message in messages]},
+                            status=201)
+
+
+class ChatMessagesView(UserInChatTestMixin, View):
+    """Return rendered messages older than a given one in json.
+
+    Messages are paginated by a 'before_pk' cursor, which is the
+    primary key of the oldest message the client already has.
+    Without it, the latest messages are returned. An 'after_pk' cursor
+    gets the ones newer than a message instead, and an 'around_pk'
+    cursor the ones around (and including) a message.
+    Once the chat runs out of messages, archived ones follow.
+    """
 
     paginate_by = 20
+    load_chat = False
 
     def get_queryset(self):
-        return self.object.messages.reverse()
+        return self.object.messages.order_by("-pk")
+
+    def get_archive_queryset(self):
+        return self.object.archived_messages.order_by("-pk")
 
     def get(self, request, *args, **kwargs):
-        # The full queryset:
-        self.object_list = self.get_queryset()
         try:
-            context = self.get_context_data()
-        except Http404:
-            # A 404 error breaks the chat; so instead send an empty response.
-            return JsonResponse({"messages_rendered": ""})
-        context["user"] = request.user
-        messages_rendered = render_to_string(
-            "msgr/messages_list.html",
-            context=context,
+            message_list, has_more, has_newer = self.get_page()
+        except ValueError:
+            # An error breaks the chat; so instead send an empty response.
+            return JsonResponse({**self.get_messages_data([], 0),
+                                 "has_more": False, "has_newer": False})
+
+        messages_data = self.get_messages_data(
+            message_list, self.object.get_read_pk(request.user)
         )
-
-        # This page of the queryset:
-        object_list = context["object_list"]
-        # Include the primary key of the first item
+        # Include primary keys of the first and last items
         # on the page in json response.
-        first_item_pk = "0"
-        if object_list.exists():
-            first_item_pk = object_list.first().pk
+        first_item_pk = last_item_pk = "0"
+        if message_list:
+            first_item_pk = message_list[0].pk
+            last_item_pk = message_list[-1].pk
             # Fetching this page means its messages are seen:
-            self.object_list.filter(pk__in=object_list).exclude(
-                sender=request.user
-            ).update(is_seen=True)
+            mark_seen(self.object, request.user, first_item_pk)
         return JsonResponse({
-            "messages_rendered": messages_rendered,
+            **messages_data,
             "first_item_pk": first_item_pk,
+            "last_item_pk": last_item_pk,
+            "has_more": has_more,
+            "has_newer": has_newer,
         })
 
+    def get_page(self):
+        """Return the messages of the page the cursor points to,
+        the latest first, and whether there are older and newer ones.
+        """
+        before_pk = self.request.GET.get("before_pk")
+        after_pk = self.request.GET.get("after_pk")
+        around_pk = self.request.GET.get("around_pk")
+        # Get one extra message to know if there are more to come.
+        if after_pk:
+            after_pk = int(after_pk)
+            newer = self.get_newer(after_pk, self.paginate_by + 1)
+            has_more = bool(self.get_older({"pk__lte": after_pk}, 1))
+            return (newer[:self.paginate_by][::-1], has_more,
+                    len(newer) > self.paginate_by)
+        if around_pk:
+            around_pk = int(around_pk)
+            half = self.paginate_by // 2
+            newer = self.get_newer(around_pk, half + 1)
+            older = self.get_older({"pk__lte": around_pk}, half + 1)
+            return (newer[:half][::-1] + older[:half], len(older) > half,
+                    len(newer) > half)
+        lookup = {"pk__lt": int(before_pk)} if before_pk else {}
+        message_list = self.get_older(lookup, self.paginate_by + 1)
+        return (message_list[:self.paginate_by],
+                len(message_list) > self.paginate_by, False)
+
+    def get_older(self, lookup, count):
+        """Return up to count messages matching the lookup, the latest
+        first; continuing with archived ones if the chat runs out of them.
+        """
+        message_list = list(self.get_queryset().filter(**lookup)[:count])
+        if len(message_list) < count:
+            # Archived messages are all older than the others.
+            message_list += self.get_archive_queryset().filter(
+                **lookup
+            )[:count - len(message_list)]
+        return message_list
+
+    def get_newer(self, pk, count):
+        """Return up to count messages newer than pk, the oldest first;
+        starting with archived ones, if it's in the archive.
+        """
+        message_list = list(self.get_archive_queryset().filter(pk__gt=pk)
+                            .reverse()[:count])
+        if len(message_list) < count:
+            message_list += self.get_queryset().filter(
+                pk__gt=pk
+            ).reverse()[:count - len(message_list)]
+        return message_list
+
+    def get_messages_data(self, message_list, read_pk):
+        """Return the messages of a page in json-able form;
+        read_pk is the latest message others have seen.
+        """
+        with timing_templates():
+            messages_rendered = render_to_string(
+                "msgr/messages_list.html",
+                context={
+                    "message_list": message_list,
+                    "user": self.request.user,
+                    "read_pk": read_pk,
+                },
+            )
+        return {"messages_rendered": messages_rendered}
+
 
 class ChatUpdatesView(UserInChatTestMixin, View):
-    """Return updates about a chat in json."""
+    """Return updates about a chat in json.
 
-    def get(self, request, *args, **kwargs):
-        if request.GET:
-            response = self.get_updates(request.GET.get("latest_pk"),
-                                        request.GET.get("latest_seen_pk"))
-            return JsonResponse(response)
-        else:
+    If a 'wait' parameter is provided, the request is held open for up
+    to that many seconds (at most max_wait) until there are updates.
+    """
+
+    max_wait = 25
+    # Seconds between looking for updates while waiting; the hub only
+    # wakes requests up for writes made in the same process.
+    check_interval = 2
+    load_chat = False
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Class-based views can't be async, so wrap it in a function view.
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            return await view(request, *args, **kwargs)
+
+        async_view.view_class = view.view_class
+        async_view.view_initkwargs = view.view_initkwargs
+        async_view.__doc__ = view.__doc__
+        async_view.__module__ = view.__module__
+        async_view.__name__ = view.__name__
+        return async_view
+
+    async def dispatch(self, request, *args, **kwargs):
+        # The access test uses the database, so it runs in a thread.
+        response = await sync_to_async(super().dispatch)(request,
+                                                         *args, **kwargs)
+        if asyncio.iscoroutine(response):
+            response = await response
+        return response
+
+    async def get(self, request, *args, **kwargs):
+        if not request.GET:
             raise Http404
+        latest_pk = request.GET.get("latest_pk")
+        latest_seen_pk = request.GET.get("latest_seen_pk")
+        wait = self.get_wait()
+        if not wait:
+            response = await sync_to_async(self.get_updates)(latest_pk,
+                                                             latest_seen_pk)
+            return JsonResponse(response)
+
+        # Subscribe before looking for updates,
+        # so that nothing happens unnoticed in between.
+        queue = hub.subscribe(self.object.pk)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        woken = False
+        try:
+            while True:
+                # Once woken up by a write, it's read from the primary
+                # database, which the replicas may not have caught up to.
+                with use_primary() if woken else nullcontext():
+                    response = await sync_to_async(self.get_updates)(
+                        latest_pk, latest_seen_pk
+                    )
+                timeout = deadline - loop.time()
+                if self.has_updates(response, latest_pk) or timeout <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(queue.get(),
+                                           min(timeout, self.check_interval))
+                except asyncio.TimeoutError:
+                    woken = False
+                else:
+                    woken = True
+        finally:
+            hub.unsubscribe(self.object.pk, queue)
+        return JsonResponse(response)
+
+    def get_wait(self):
+        """Return the number of seconds to wait for updates."""
+        try:
+            wait = float(self.request.GET.get("wait", 0))
+        except ValueError:
+            return 0
+        return max(0, min(wait, self.max_wait))
+
+    @staticmethod
+    def has_updates(response, latest_pk):
+        return bool(str(response["latest_pk"]) != (latest_pk or "0")
+                    or response["seen_messages_pk"])
 
     def get_updates(self, latest_pk, latest_seen_pk):
         """Get updates according to provided arguments.
@@ -211,62 +490,97 @@ class ChatUpdatesView(UserInChatTestMixin, View):
         can be used in later calls to the method.
         """
 
-        new_messages_rendered, latest_pk = self.get_new_messages(latest_pk)
-        seen_messages_pk, latest_seen_pk = self.get_seen_messages(latest_seen_pk)
+        # The latest message that others have seen.
+        read_pk = self.object.get_read_pk(self.request.user)
+        new_messages_data, latest_pk = self.get_new_messages(latest_pk,
+                                                             read_pk)
+        seen_messages_pk, latest_seen_pk = self.get_seen_messages(
+            latest_seen_pk, read_pk
+        )
         return {
-            "new_messages_rendered": new_messages_rendered,
+            **new_messages_data,
             "latest_pk": latest_pk,
             "seen_messages_pk": seen_messages_pk,
             "latest_seen_pk": latest_seen_pk,
         }
 
-    def get_new_messages(self, latest_pk):
+    def get_new_messages(self, latest_pk, read_pk):
         """Get all messages in this chat that
         have been sent after the given.
 
-        Return rendered html of all new messages and
+        Return json-able data of all new messages and
         primary key of the last one (updated latest_pk).
         """
 
         if not latest_pk:
             latest_pk = "0"
-        new_messages = self.object.messages.filter(pk__gt=latest_pk)
-        new_messages_rendered = ""
+        new_messages = list(self.object.messages.filter(
+            pk__gt=latest_pk
+        ).order_by("-pk"))
 
-        if new_messages.exists():
+        if new_messages:
+            latest_pk = new_messages[0].pk
             # Fetching these messages means they are seen:
-            new_messages.exclude(sender=self.request.user).update(is_seen=True)
-            new_messages_rendered = render_to_string(
-                "msgr/messages_list.html",
-                context={
-                    "message_list": new_messages.reverse(),
-                    "user": self.request.user,
-                },
-            )
-            latest_pk = new_messages.last().pk
-        return new_messages_rendered, latest_pk
+            mark_seen(self.object, self.request.user, latest_pk)
+        return self.get_new_messages_data(new_messages, read_pk), latest_pk
 
-    def get_seen_messages(self, latest_seen_pk):
-        """Get all messages in this chat that
+    def get_new_messages_data(self, new_messages, read_pk):
+        """Return the new messages in json-able form;
+        read_pk is the latest message others have seen.
+        """
+        new_messages_rendered = ""
+        if new_messages:
+            with timing_templates():
+                new_messages_rendered = render_to_string(
+                    "msgr/messages_list.html",
+                    context={
+                        "message_list": new_messages,
+                        "user": self.request.user,
+                        "read_pk": read_pk,
+                    },
+                )
+        return {"new_messages_rendered": new_messages_rendered}
+
+    def get_seen_messages(self, latest_seen_pk, read_pk):
+        """Get all of the user's messages in this chat that
         have been seen since the given.
 
         Return list of all new messages' primary keys and
-        primary key of the last one (updated latest_seen_pk).
+        primary key of the latest seen message (updated latest_seen_pk).
         """
 
         if not latest_seen_pk:
             latest_seen_pk = "0"
-        seen_messages = self.object.messages.filter(pk__gt=latest_seen_pk,
-                                                    sender=self.request.user,
-                                                    is_seen=True)
         seen_messages_pk = []
 
-        if seen_messages.exists():
-            seen_messages_pk = [m.pk for m in seen_messages]
-            latest_seen_pk = seen_messages_pk[-1]
+        if read_pk > int(latest_seen_pk):
+            seen_messages_pk = list(self.object.messages.filter(
+                pk__gt=latest_seen_pk,
+                pk__lte=read_pk,
+                sender=self.request.user,
+            ).order_by("pk").values_list("pk", flat=True))
+            latest_seen_pk = read_pk
         return seen_messages_pk, latest_seen_pk
 
 
+class ChatMessagesDataView(ChatMessagesView):
+    """Like ChatMessagesView, but with compact messages data
+    for the client to render, instead of rendered html.
+    """
+
+    def get_messages_data(self, message_list, read_pk):
+        return serialize_messages(message_list, read_pk)
+
+
+class ChatUpdatesDataView(ChatUpdatesView):
+    """Like ChatUpdatesView, but with compact messages data
+    for the client to render, instead of rendered html.
+    """
+
+    def get_new_messages_data(self, new_messages, read_pk):
+        return serialize_messages(new_messages, read_pk)
+
+
 class ChatDeleteMessageView(View):
     """Delete a user's message with no response."""
 
@@ -274,5 +588,22 @@ class ChatDeleteMessageView(View):
         message = get_object_or_404(Message, pk=request.POST.get("message"))
         # A user can only delete their own message.
         if request.user == message.sender:
+            pk = message.pk
+            message.chat.remove_unread(message)
             message.delete()
+            fragments.forget_message(pk)
+            hub.publish(message.chat_id, {"type": "delete", "pk": pk})
         return HttpResponse(status=204)
+
+
+class MetricsView(UserPassesTestMixin, View):
+    """Return the metrics of the views (see MetricsMiddleware)
+    in Prometheus' text format, to staff only.
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(metrics.render(),
+                            content_type="text/plain; version=0.0.4")
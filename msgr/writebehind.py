@@ -0,0 +1,114 @@
+import atexit
+import logging
+import threading
+
+from django.db import connections
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between flushes of the buffers, which is how long
+# the buffered values may take to be written.
+INTERVAL = 2
+# Number of rows a buffer may have before it's flushed early.
+MAX_SIZE = 1000
+# Number of rows each UPDATE query writes.
+BATCH_SIZE = 500
+
+
+class WriteBehindBuffer:
+    """Collect the latest values of a field of rows (e.g. timestamps),
+    and write them later, all at once.
+
+    Values only ever increase: each row keeps the greatest of its
+    buffered values and the one already in the database.
+    """
+
+    def __init__(self, model, field_name):
+        self.model = model
+        self.field_name = field_name
+        self._pending = {}
+        self._lock = threading.Lock()
+        buffers.append(self)
+
+    def add(self, pk, value):
+        with self._lock:
+            if pk not in self._pending or value > self._pending[pk]:
+                self._pending[pk] = value
+            size = len(self._pending)
+        flusher.start()
+        if size >= MAX_SIZE:
+            flusher.wake_up()
+
+    def flush(self):
+        """Write the buffered values to the database."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        items = list(pending.items())
+        try:
+            for i in range(0, len(items), BATCH_SIZE):
+                self.write(items[i:i + BATCH_SIZE])
+        except Exception:
+            # Keep them for the next flush.
+            for pk, value in items:
+                self.add(pk, value)
+            raise
+
+    def write(self, items):
+        field = self.model._meta.get_field(self.field_name)
+        self.model.objects.filter(pk__in=[pk for pk, _ in items]).update(**{
+            self.field_name: Greatest(F(self.field_name), Case(
+                *[When(pk=pk, then=Value(value)) for pk, value in items],
+                output_field=field,
+            )),
+        })
+
+
+# All of the buffers, which are flushed together.
+buffers = []
+
+
+def flush_all():
+    for buffer in buffers:
+        try:
+            buffer.flush()
+        except Exception:
+            logger.exception("Failed to flush %s.%s updates.",
+                             buffer.model.__name__, buffer.field_name)
+
+
+class Flusher:
+    """A background thread that flushes all buffers
+    every INTERVAL seconds, or when one of them is full.
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, daemon=True,
+                                                name="write-behind")
+                self._thread.start()
+                # Whatever is buffered is still written on shutdown.
+                atexit.register(flush_all)
+
+    def wake_up(self):
+        self._wake_up.set()
+
+    def run(self):
+        while True:
+            self._wake_up.wait(INTERVAL)
+            self._wake_up.clear()
+            flush_all()
+            connections.close_all()
+
+
+flusher = Flusher()
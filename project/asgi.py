@@ -13,4 +13,24 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Importing URLs requires the apps to be loaded first.
+from django.urls import Resolver404, resolve  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """Route websocket connections with project/routing.py,
+    and everything else to django.
+    """
+    if scope["type"] == "websocket":
+        try:
+            match = resolve(scope["path"], urlconf="project.routing")
+        except Resolver404:
+            await send({"type": "websocket.close"})
+            return
+        scope = dict(scope, url_route={"args": match.args,
+                                       "kwargs": match.kwargs})
+        await match.func(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -0,0 +1,12 @@
+"""project WebSocket URL Configuration
+
+Works like the `urlpatterns` in urls.py, but the views are
+ASGI applications that handle websocket connections.
+"""
+
+from django.urls import include, path
+
+
+urlpatterns = [
+    path("m/", include("msgr.routing")),
+]
@@ -31,6 +31,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'msgr.middleware.PrimaryPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -67,6 +68,42 @@ WSGI_APPLICATION = 'project.wsgi.application'
 DATABASES = {
 }
 
+# Aliases in DATABASES of read-only replicas of the default database,
+# which reads are spread between.
+DATABASE_REPLICAS = []
+
+DATABASE_ROUTERS = ['msgr.routers.ReplicaRouter']
+
+
+# Metrics
+# Add 'msgr.middleware.MetricsMiddleware' to the top of MIDDLEWARE to
+# record the metrics of the views; the queries and template rendering
+# of this share of the requests are recorded as well.
+
+METRICS_SAMPLE_RATE = 0.01
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered messages. They're only stale after a user's name or ID
+    # changes, and local memory isn't shared between processes, so the
+    # others see the change when their entries expire. Use a shared cache
+    # (e.g. memcached or redis) instead when running several processes.
+    'messages': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'messages',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
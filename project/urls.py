@@ -18,10 +18,13 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.contrib.auth import views as auth_views
-from django.urls import include, path
+from django.urls import include, path, re_path
+from django.views.decorators.cache import cache_control
 from django.views.generic import TemplateView
+from django.views.static import serve
 
 from accounts import views as account_views
+from accounts.pictures import VARIANTS_DIR
 
 
 urlpatterns = [
@@ -66,4 +69,12 @@ urlpatterns = [
 ]
 
 if settings.DEBUG:
+    # Picture variants never change, so they can be cached forever.
+    urlpatterns += [
+        re_path(r"^%s(?P<path>%s/.*)$" % (settings.MEDIA_URL.lstrip("/"),
+                                          VARIANTS_DIR),
+                cache_control(public=True, max_age=31536000,
+                              immutable=True)(serve),
+                {"document_root": settings.MEDIA_ROOT}),
+    ]
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)